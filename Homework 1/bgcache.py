@@ -0,0 +1,86 @@
+"""
+Keeps computed background images on disk, keyed by the frames they were built from.
+"""
+import os
+import json
+import hashlib
+from contextlib import suppress
+
+import numpy as np
+
+import framesource
+import part2
+
+CACHE_DIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + ".cache"
+
+
+def fingerprint(path, **params):
+    """Hashes a frame sequence's directory along with the parameters of the background
+    model, and separately hashes the file list, sizes, and modification times of the
+    frames.
+
+    Args:
+        path (str): The directory holding the frames.
+        **params: The parameters the background was computed with.
+
+    Returns:
+        The hex digest of the directory and parameters, and the hex digest of the frames.
+    """
+    files = []
+    for name in framesource.sequenceFiles(path):
+        stat = os.stat(name)
+        files.append((os.path.basename(name), stat.st_size, stat.st_mtime_ns))
+
+    directory = json.dumps([os.path.realpath(path), params], sort_keys=True)
+    directory = hashlib.sha1(directory.encode()).hexdigest()[:16]
+    contents = hashlib.sha1(json.dumps(files).encode()).hexdigest()
+
+    return directory, contents
+
+
+def cachedBackground(path, workers=None, cacheDir=CACHE_DIR, percentile=None):
+    """Loads the background of a frame sequence from the cache, computing and storing
+    it first if the frames or parameters have changed.
+
+    Args:
+        path (str): The directory to load the frames from.
+        workers (int, optional): Decode the frames in a pool of this many threads, 0 for
+            one per core. The pooled decoder changes the frames by a few grey levels, and
+            so the result. Defaults to None.
+        cacheDir (str, optional): The directory to keep cached backgrounds in. Defaults
+            to ".cache" beside this module.
+        percentile (float, optional): Use this per-pixel percentile of the frames instead
+            of the average. Defaults to None.
+
+    Returns:
+        The background image, memory-mapped read only when it came from the cache.
+    """
+    # The pooled decoder reads straight to greyscale, which is not bit identical
+    if percentile is None:
+        directory, contents = fingerprint(path, model="mean", pooled=workers is not None)
+    else:
+        directory, contents = fingerprint(path, model="percentile", percentile=percentile,
+            pooled=workers is not None)
+    cacheFile = cacheDir + os.path.sep + directory + "-" + contents + ".npy"
+    if os.path.isfile(cacheFile):
+        return np.load(cacheFile, mmap_mode='r')
+
+    if percentile is None:
+        avg = part2.averageBackground(path=path, usePathPrefix=False, workers=workers)
+    else:
+        avg = part2.percentileBackground(path=path, percentile=percentile, usePathPrefix=False,
+            workers=workers)
+
+    # Drop stale entries for this directory, then write atomically
+    os.makedirs(cacheDir, exist_ok=True)
+    for name in os.listdir(cacheDir):
+        if name.startswith(directory + "-") and name.endswith(".npy"):
+            # Another process may have removed it first
+            with suppress(FileNotFoundError):
+                os.remove(cacheDir + os.path.sep + name)
+    tempFile = cacheFile + ".%d.tmp" % os.getpid()
+    with open(tempFile, 'wb') as out:
+        np.save(out, avg)
+    os.replace(tempFile, cacheFile)
+
+    return avg
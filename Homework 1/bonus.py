@@ -4,14 +4,189 @@ bounding boxes around each car.
 """
 import os
 import argparse
-from time import sleep
 
 import cv2
+import numpy as np
 
+import bgcache
+import framesource
 import part2
 import part3
+import playback
 
-def processVideo(path='frames', useGauss=True, usePathPrefix=True, hz=None):
+MIN_BOX_AREA = 50
+ROI_TILE_SIZE = 32
+
+def findBlobs(otsu, minArea=MIN_BOX_AREA):
+    """Finds the connected blobs in a thresholded image, dropping any whose bounding
+    box covers less than the minimum area.
+
+    Args:
+        otsu (cv2.Mat): The binary image to search.
+        minArea (int, optional): The smallest bounding box area to keep. Defaults to 50.
+
+    Returns:
+        boxes, areas, centroids: The (K, 4) x, y, w, h boxes, the (K,) pixel counts,
+            and the (K, 2) centroids of the kept blobs.
+    """
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(otsu, connectivity=8)
+
+    # Label 0 is the background
+    boxes = stats[1:, :cv2.CC_STAT_AREA]
+    keep = boxes[:, 2] * boxes[:, 3] >= minArea
+
+    return boxes[keep], stats[1:, cv2.CC_STAT_AREA][keep], centroids[1:][keep]
+
+def findBoxes(otsu, minArea=MIN_BOX_AREA):
+    """Finds the bounding boxes of the blobs in a thresholded image.
+
+    Args:
+        otsu (cv2.Mat): The binary image to search.
+        minArea (int, optional): The smallest box area to keep. Defaults to 50.
+
+    Returns:
+        A list of (x, y, w, h) boxes.
+    """
+    boxes, _, _ = findBlobs(otsu, minArea=minArea)
+
+    return [tuple(box) for box in boxes.tolist()]
+
+def boxDeviation(referenceBoxes, boxes):
+    """Measures how far a set of boxes deviates from a reference set by matching each
+    reference box to the box it overlaps most.
+
+    Args:
+        referenceBoxes (list): The (x, y, w, h) boxes to compare against.
+        boxes (list): The (x, y, w, h) boxes to measure.
+
+    Returns:
+        meanIou, meanOffset, missed: The mean intersection over union of each reference
+            box with its match, the mean corner offset in pixels of the matched boxes,
+            and how many reference boxes had no overlapping match.
+    """
+    if len(referenceBoxes) == 0: return 1., 0., 0
+    if len(boxes) == 0: return 0., 0., len(referenceBoxes)
+
+    ref = np.asarray(referenceBoxes, dtype=np.float64)[:, None, :]
+    box = np.asarray(boxes, dtype=np.float64)[None, :, :]
+    width = np.minimum(ref[..., 0] + ref[..., 2], box[..., 0] + box[..., 2]) - \
+        np.maximum(ref[..., 0], box[..., 0])
+    height = np.minimum(ref[..., 1] + ref[..., 3], box[..., 1] + box[..., 3]) - \
+        np.maximum(ref[..., 1], box[..., 1])
+    overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+    union = ref[..., 2] * ref[..., 3] + box[..., 2] * box[..., 3] - overlap
+    iou = overlap / union
+
+    best = np.argmax(iou, axis=1)
+    bestIou = iou[np.arange(len(best)), best]
+    matched = bestIou > 0
+    if not matched.any(): return 0., 0., len(referenceBoxes)
+
+    # Compare the top left and bottom right corners of each match
+    refCorners = ref[matched, 0, :2], ref[matched, 0, :2] + ref[matched, 0, 2:]
+    boxCorners = box[0, best[matched], :2], box[0, best[matched], :2] + box[0, best[matched], 2:]
+    offset = (np.linalg.norm(refCorners[0] - boxCorners[0], axis=1) + \
+        np.linalg.norm(refCorners[1] - boxCorners[1], axis=1)) / 2
+
+    return bestIou.mean(), offset.mean(), int((~matched).sum())
+
+def drawBoxes(otsu, boxes):
+    """Draws bounding boxes over a colour copy of a thresholded image.
+
+    Args:
+        otsu (cv2.Mat): The binary image to draw over.
+        boxes (list): The (x, y, w, h) boxes to draw.
+
+    Returns:
+        The BGR image with the boxes drawn.
+    """
+    bgr = cv2.cvtColor(otsu, cv2.COLOR_GRAY2BGR)
+    for x, y, w, h in boxes:
+        bgr = cv2.rectangle(bgr, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+    return bgr
+
+def streamDetections(path, backgroundImg=None, useGauss=True, model=None, workers=None,
+    batchSize=None, minArea=MIN_BOX_AREA, roiMargin=None, refreshInterval=10, pyramidLevels=None):
+    """Thresholds each frame against the background and finds its bounding boxes
+    as soon as it is decoded.
+
+    Args:
+        path (str): The directory to load the frames from.
+        backgroundImg (cv2.Mat, optional): The background image to compare against.
+            Defaults to None.
+        useGauss (bool, optional): Use a guassian blur prior to Otsu's method. Defaults to True.
+        model (part3.AdaptiveBackground, optional): A background model to compare against
+            and update with each frame instead of a fixed background. Defaults to None.
+        workers (int, optional): Decode the frames in a pool of this many threads, 0 for
+            one per core. The pooled decoder changes the frames by a few grey levels, and
+            so the result. Defaults to None.
+        batchSize (int, optional): Threshold this many frames at a time against the fixed
+            background with part3.batchBackgroundDifference. Defaults to None.
+        minArea (int, optional): The smallest box area to keep. Defaults to 50.
+        roiMargin (int, optional): Only difference the frame within this many pixels of
+            the previous frame's boxes, reusing the Otsu threshold of the last full
+            frame. Motion that starts away from every box is not seen until the next
+            full frame, up to refreshInterval - 1 frames later. Defaults to None.
+        refreshInterval (int, optional): Difference the full frame every this many
+            frames when using roiMargin. Defaults to 10.
+        pyramidLevels (int, optional): Find motion on the frame halved this many times,
+            refining only the tiles with motion at full resolution. Defaults to None.
+
+    Raises:
+        ValueError: When batchSize is combined with a model, roiMargin or pyramidLevels,
+            which the batched path does not support, or refreshInterval is below 1.
+
+    Yields:
+        The Otsu threshold image and the list of (x, y, w, h) boxes for each frame.
+    """
+    if batchSize is not None and (model is not None or roiMargin is not None or
+        pyramidLevels is not None):
+        raise ValueError("batchSize cannot be combined with an adaptive model, roiMargin " + \
+            "or pyramidLevels.")
+    if roiMargin is not None and refreshInterval < 1:
+        raise ValueError("refreshInterval must be at least 1.")
+
+    if batchSize is not None:
+        out = None
+        for batch in framesource.readBatches(path, batchSize, workers=workers):
+            if out is None: out = tuple(np.empty_like(batch) for _ in range(3))
+            _, _, otsuImgs = part3.batchBackgroundDifference(batch, backgroundImg,
+                useGauss=useGauss, out=out)
+            for otsu in otsuImgs:
+                yield otsu, findBoxes(otsu, minArea=minArea)
+        return
+
+    source = framesource.readFrames(path, workers=workers)
+    boxes = []
+    try:
+        for i, grey in enumerate(source):
+            if model is not None:
+                _, _, otsu = model.apply(grey, useGauss=useGauss)
+            elif pyramidLevels is not None:
+                _, otsu = part3.pyramidDifference(grey, backgroundImg, levels=pyramidLevels,
+                    useGauss=useGauss)
+            elif roiMargin is None:
+                _, _, otsu = part3.backgroundDifference(grey, backgroundImg, useGauss=useGauss)
+            elif i % refreshInterval == 0:
+                absDiff = cv2.absdiff(grey, backgroundImg)
+                otsuThresh, otsu = part3.otsuDifference(absDiff, useGauss=useGauss)
+            else:
+                # Motion can only be near where it was last frame
+                tiles = part3.boxTiles(boxes, roiMargin, grey.shape, tileSize=ROI_TILE_SIZE)
+                windows = part3.tileWindows(tiles, grey.shape, tileSize=ROI_TILE_SIZE)
+                otsu = part3.roiBackgroundDifference(grey, backgroundImg, windows, otsuThresh,
+                    useGauss=useGauss)
+
+            boxes = findBoxes(otsu, minArea=minArea)
+            yield otsu, boxes
+    finally:
+        source.close()
+
+def processVideo(path='frames', useGauss=True, usePathPrefix=True, hz=None, singlePass=False,
+    headless=False, adaptiveAlpha=None, workers=None, useCache=True, batchSize=None,
+    minArea=MIN_BOX_AREA, roiMargin=None, refreshInterval=10, pyramidLevels=None,
+    percentile=None):
     """Get the threshold of a video then draw bounding boxes on it.
 
     Args:
@@ -19,40 +194,90 @@ def processVideo(path='frames', useGauss=True, usePathPrefix=True, hz=None):
         useGauss (bool, optional): Use a guassian blur prior to Otsu's method. Defaults to True.
         usePathPrefix (bool, optional): Use the path prefix of this file. Defaults to True.
         hz (float, optional): The refresh rate of the video (approx). Defaults to None.
+        singlePass (bool, optional): Find the bounding boxes of each frame as soon as it is
+            thresholded instead of buffering every mask first. Defaults to False.
+        headless (bool, optional): Skip all display and pacing, processing at full decode
+            speed. Implies singlePass. Defaults to False.
+        adaptiveAlpha (float, optional): Compare against a moving average background with
+            this weight per frame instead of the average of the whole clip. Implies
+            singlePass. Defaults to None.
+        workers (int, optional): Decode the frames in a pool of this many threads, 0 for
+            one per core. The pooled decoder changes the frames by a few grey levels, and
+            so the result. Defaults to None.
+        useCache (bool, optional): Load the average background from the on-disk cache,
+            computing it only when the frames have changed. Defaults to True.
+        batchSize (int, optional): Threshold this many frames at a time in the single
+            pass. Implies singlePass. Defaults to None.
+        minArea (int, optional): The smallest bounding box area to keep. Defaults to 50.
+        roiMargin (int, optional): Only difference the frame within this many pixels of the
+            previous frame's boxes in the single pass, missing new motion until the next
+            full frame. Defaults to None.
+        refreshInterval (int, optional): Difference the full frame every this many frames
+            when using roiMargin. Defaults to 10.
+        pyramidLevels (int, optional): Find motion on the frame halved this many times in
+            the single pass, refining only the tiles with motion. Defaults to None.
+        percentile (float, optional): Use this per-pixel percentile of the frames as the
+            background instead of the average. Defaults to None.
+
+    Returns:
+        The list of (x, y, w, h) boxes for each frame when running in a single pass,
+        otherwise None.
     """
     pathPrefix = os.path.dirname(os.path.realpath(__file__))
     if usePathPrefix: path = pathPrefix + os.path.sep + path
 
+    def loadBackground():
+        if useCache: return bgcache.cachedBackground(path, workers=workers, percentile=percentile)
+        if percentile is not None:
+            return part2.percentileBackground(path=path, percentile=percentile,
+                usePathPrefix=False, workers=workers)
+        return part2.averageBackground(path=path, usePathPrefix=False, workers=workers)
+
+    # Threshold, find boxes, and display each frame in one pass
+    if adaptiveAlpha is not None or roiMargin is not None or pyramidLevels is not None or \
+        batchSize is not None or singlePass or headless:
+        avg = None
+        model = None
+        if adaptiveAlpha is None:
+            avg = loadBackground()
+        else:
+            model = part3.AdaptiveBackground(alpha=adaptiveAlpha)
+
+        frameBoxes = []
+        detections = streamDetections(path, avg, useGauss=useGauss, model=model,
+            workers=workers, batchSize=batchSize, minArea=minArea, roiMargin=roiMargin,
+            refreshInterval=refreshInterval, pyramidLevels=pyramidLevels)
+        if headless:
+            for otsu, boxes in detections: frameBoxes.append(boxes)
+            return frameBoxes
+
+        def drawDetection(detection):
+            otsu, boxes = detection
+            frameBoxes.append(boxes)
+            return drawBoxes(otsu, boxes)
+
+        print(playback.play(detections, drawDetection, 'bonus', fps=hz))
+        cv2.waitKey(0)
+        cv2.destroyWindow('bonus')
+        return frameBoxes
+
     # Gather average, process video with Otsu's method, then display
-    avg = part2.averageBackground(path=path, usePathPrefix=False)
-    cap = cv2.VideoCapture(path + os.path.sep + "%06d.jpg")
+    avg = loadBackground()
+    source = framesource.readFrames(path, workers=workers)
     otsuFrames = []
-    while cap.isOpened():
-        _, frame = cap.read()
-        if frame is None: break
-        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        _, _, otsu = part3.backgroundDifference(grey, avg, useGauss=useGauss)
 
+    def differenceFrame(grey):
+        _, _, otsu = part3.backgroundDifference(grey, avg, useGauss=useGauss)
         otsuFrames.append(otsu)
-        cv2.imshow('bonus', otsu)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if hz is not None: sleep(1/hz)
-    cap.release()
+        return otsu
+
+    print(playback.play(source, differenceFrame, 'bonus', fps=hz))
+    source.close()
     cv2.waitKey(0)
 
     # Draw bounding boxes and display
-    for otsu in otsuFrames:
-        contours, _ = cv2.findContours(otsu, cv2.RETR_LIST, cv2.CHAIN_APPROX_TC89_KCOS)
-
-        bgr = cv2.cvtColor(otsu, cv2.COLOR_GRAY2BGR)
-        for cnt in contours:
-            x, y, w, h = cv2.boundingRect(cnt)
-            if w * h < 50: continue
-            bgr = cv2.rectangle(bgr, (x, y), (x+w, y+h), (0, 255, 0), 2)
-
-        cv2.imshow('bonus', bgr)
-        if cv2.waitKey(1) & 0xFF == ord('q'):break
-        if hz is not None: sleep(1/hz)
+    print(playback.play(otsuFrames, lambda otsu: drawBoxes(otsu, findBoxes(otsu, minArea=minArea)),
+        'bonus', fps=hz))
     cv2.waitKey(0)
     cv2.destroyWindow('bonus')
 
@@ -66,12 +291,67 @@ def main():
         "to load the video from.")
     parser.add_argument("--useGauss", nargs="?", type=bool, default=True, \
         help="Apply a gaussian filter prior to using Otsu's method.")
+    parser.add_argument("--singlePass", action="store_true", help="Find the bounding " + \
+        "boxes of each frame as soon as it is thresholded.")
+    parser.add_argument("--headless", action="store_true", help="Run without any display " + \
+        "or pacing, printing the box count of each frame instead.")
+    parser.add_argument("--adaptive", nargs="?", type=float, default=None, const=0.05,
+        help="Compare against a moving average background with the given weight per " + \
+        "frame instead of the average of the whole video.")
+    parser.add_argument("--workers", nargs="?", type=int, default=None, const=0, \
+        help="Decode the frames in a pool of this many threads (one per core if no count is " + \
+        "given). The pooled decoder changes the frames slightly, and so the results.")
+    parser.add_argument("--noCache", action="store_true", help="Always recompute the " + \
+        "average background instead of loading it from the cache.")
+    parser.add_argument("--batch", nargs="?", type=int, default=None, const=16, help="Threshold " + \
+        "this many frames at a time in the single pass (16 if no count is given). Cannot " + \
+        "be combined with --adaptive, --roi or --pyramid.")
+    parser.add_argument("--minArea", nargs="?", type=int, default=MIN_BOX_AREA, help="The " + \
+        "smallest bounding box area to keep.")
+    parser.add_argument("--roi", nargs="?", type=int, default=None, const=16, help="Only " + \
+        "difference each frame within this many pixels of the previous frame's boxes. Motion " + \
+        "away from every box is missed until the next --refresh frame. When headless, also " + \
+        "reports how far the boxes deviate from the full frame path.")
+    parser.add_argument("--refresh", type=int, default=10, help="Difference the " + \
+        "full frame every this many frames when using --roi.")
+    parser.add_argument("--pyramid", nargs="?", type=int, default=None, const=2, help="Find " + \
+        "motion on each frame halved this many times, refining only tiles with motion. " + \
+        "When headless, also reports how far the boxes deviate from the full resolution path.")
+    parser.add_argument("--percentile", nargs="?", type=float, default=None, const=50, \
+        help="Use this per-pixel percentile of the frames (the median if no value is given) " + \
+        "as the background instead of the average.")
     args = parser.parse_args()
+    if args.batch is not None and (args.adaptive is not None or args.roi is not None or
+        args.pyramid is not None):
+        parser.error("--batch cannot be combined with --adaptive, --roi or --pyramid")
+    if args.refresh < 1:
+        parser.error("--refresh must be at least 1")
+
+    path = 'frames'
+    usePathPrefix = True
+    if args.inpath is not None:
+        path = args.inpath
+        usePathPrefix = False
+    hz = None if args.headless else 24
+    options = dict(path=path, usePathPrefix=usePathPrefix, useGauss=args.useGauss,
+        workers=args.workers, useCache=not args.noCache, minArea=args.minArea,
+        percentile=args.percentile)
+    frameBoxes = processVideo(hz=hz, singlePass=args.singlePass, headless=args.headless,
+        adaptiveAlpha=args.adaptive, batchSize=args.batch, roiMargin=args.roi,
+        refreshInterval=args.refresh, pyramidLevels=args.pyramid, **options)
+
+    if args.headless:
+        for i, boxes in enumerate(frameBoxes):
+            print("%06d: %d" % (i, len(boxes)))
 
-    if args.inpath is None:
-        processVideo(usePathPrefix=args.useGauss, hz=24)
-    else:
-        processVideo(path=args.inpath, usePathPrefix=False, useGauss=args.useGauss, hz=24)
+    if args.headless and (args.pyramid is not None or args.roi is not None):
+        referenceBoxes = processVideo(headless=True, **options)
+        deviations = np.array([boxDeviation(ref, boxes) for ref, boxes in
+            zip(referenceBoxes, frameBoxes)])
+        print("Mean IoU against the full frame path: " + str(deviations[:, 0].mean()))
+        print("Mean corner offset: " + str(deviations[:, 1].mean()) + "px")
+        print("Missed boxes: " + str(int(deviations[:, 2].sum())) + " out of " + \
+            str(sum(len(boxes) for boxes in referenceBoxes)))
 
     return
 
@@ -0,0 +1,146 @@
+"""
+Reads a numbered sequence of frames as greyscale images, optionally decoding them
+in parallel.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FRAME_PATTERN = "%06d.jpg"
+REDUCTIONS = (1, 2, 4, 8)
+
+
+def sequenceFiles(path, pattern=FRAME_PATTERN):
+    """Lists the files of a numbered frame sequence, in order, stopping at the
+    first missing number.
+
+    Args:
+        path (str): The directory holding the frames.
+        pattern (str, optional): The printf style name of each frame. Defaults to "%06d.jpg".
+
+    Returns:
+        A list of file paths.
+    """
+    files = []
+    while True:
+        name = path + os.path.sep + (pattern % len(files))
+        if not os.path.isfile(name): break
+        files.append(name)
+
+    return files
+
+
+def reduceFrame(grey, reduction):
+    """Shrinks a greyscale frame by averaging each reduction by reduction block.
+
+    Args:
+        grey (cv2.Mat): The frame to shrink.
+        reduction (int): One of REDUCTIONS.
+
+    Returns:
+        cv2.Mat: The shrunken frame.
+    """
+    if reduction == 1: return grey
+    return cv2.resize(grey, None, fx=1/reduction, fy=1/reduction, interpolation=cv2.INTER_AREA)
+
+
+def readGrey(name, reduction):
+    """Decodes one frame file straight to greyscale and shrinks it.
+
+    Args:
+        name (str): The file to read.
+        reduction (int): One of REDUCTIONS.
+
+    Returns:
+        cv2.Mat: The frame, or None if it could not be read.
+    """
+    grey = cv2.imread(name, cv2.IMREAD_GRAYSCALE)
+    return None if grey is None else reduceFrame(grey, reduction)
+
+
+def readFrames(path, workers=None, prefetch=None, reduction=1):
+    """Reads each frame of a numbered sequence as greyscale.
+
+    With no workers the frames are read one at a time through cv2.VideoCapture and
+    converted from BGR, exactly like the original scripts. With workers, each file is
+    decoded straight to greyscale with cv2.imread in a thread pool, keeping at most
+    prefetch frames in flight and yielding them in order. The two decoders do not agree:
+    most pixels of a pooled frame differ from the serial one by a few grey levels, so
+    workers change the results of anything computed from the frames. Either way, a
+    reduction averages blocks of the decoded frame.
+
+    Args:
+        path (str): The directory holding the frames.
+        workers (int, optional): The number of decoding threads. Defaults to None.
+        prefetch (int, optional): The most frames decoded ahead of the consumer.
+            Defaults to twice the number of workers.
+        reduction (int, optional): Shrink each frame by 1, 2, 4, or 8. Defaults to 1.
+
+    Yields:
+        Each greyscale frame.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError("Frame reduction must be one of " + str(list(REDUCTIONS)) + ".")
+
+    if workers is None:
+        cap = cv2.VideoCapture(path + os.path.sep + FRAME_PATTERN)
+        try:
+            while cap.isOpened():
+                _, frame = cap.read()
+                if frame is None: break
+                yield reduceFrame(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), reduction)
+        finally:
+            cap.release()
+        return
+
+    # Keep a bounded window of decodes running ahead of the consumer
+    if workers <= 0: workers = os.cpu_count() or 1
+    if prefetch is None: prefetch = 2 * workers
+    files = iter(sequenceFiles(path))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for name in files:
+                pending.append(pool.submit(readGrey, name, reduction))
+                if len(pending) >= prefetch: break
+            while pending:
+                grey = pending.popleft().result()
+                for name in files:
+                    pending.append(pool.submit(readGrey, name, reduction))
+                    break
+                if grey is None: return
+                yield grey
+        finally:
+            for future in pending: future.cancel()
+
+
+def readBatches(path, batchSize, workers=None, prefetch=None, reduction=1):
+    """Reads a numbered sequence as stacks of greyscale frames. The same buffer is
+    reused for every batch, so each batch is only valid until the next is read.
+
+    Args:
+        path (str): The directory holding the frames.
+        batchSize (int): The most frames in each stack.
+        workers (int, optional): The number of decoding threads. Defaults to None.
+        prefetch (int, optional): The most frames decoded ahead of the consumer.
+            Defaults to twice the number of workers.
+        reduction (int, optional): Shrink each frame by 1, 2, 4, or 8. Defaults to 1.
+
+    Yields:
+        Each (n, H, W) uint8 stack of frames, with n at most batchSize.
+    """
+    batch = None
+    count = 0
+    for grey in readFrames(path, workers=workers, prefetch=prefetch, reduction=reduction):
+        if batch is None:
+            batch = np.empty((batchSize,) + grey.shape, dtype=grey.dtype)
+        batch[count] = grey
+        count += 1
+        if count == batchSize:
+            yield batch
+            count = 0
+    if count > 0:
+        yield batch[:count]
@@ -1,21 +1,33 @@
 """
-Creates a background image by averaging together all of the frames provided.
+Creates a background image by averaging together all of the frames provided, or by
+taking their per-pixel median (or any percentile).
 """
 import os
 import argparse
-from time import sleep
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 import numpy as np
 
+import framesource
+import playback
 
-def averageBackground(path="frames", showVideo=False, usePathPrefix=True, hz=None):
+
+def averageBackground(path="frames", showVideo=False, usePathPrefix=True, hz=None, streaming=True,
+    workers=None):
     """Averages out a set of frames into the greyscale background.
 
     Args:
         path (str, optional): The directory to load the frames from. Defaults to "frames".
         showVideo (bool, optional): Show the video during processing and after. Defaults to False.
         usePathPrefix (bool, optional): Use the path prefix of the module. Defaults to True.
+        hz (float, optional): The refresh rate of the video (approx). Defaults to None.
+        streaming (bool, optional): Fold each frame into a running sum as it is decoded
+            instead of keeping every frame in memory. Defaults to True.
+        workers (int, optional): Decode the frames in a pool of this many threads, 0 for
+            one per core. The pooled decoder changes the frames by a few grey levels, and
+            so the result. Defaults to None.
 
     Returns:
         An opencv image.
@@ -23,25 +35,37 @@ def averageBackground(path="frames", showVideo=False, usePathPrefix=True, hz=Non
     pathPrefix = os.path.dirname(os.path.realpath(__file__))
     if usePathPrefix: path = pathPrefix + os.path.sep + path
 
-    # Load all frames then average
-    cap = cv2.VideoCapture(path + os.path.sep + "%06d.jpg")
+    # Load all frames then average. When streaming, only a float64 running sum the
+    # size of one frame is kept. The sum of uint8 values is exact in float64, so the
+    # result matches the mean over the full stack.
     frames = []
-    while cap.isOpened:
-        _, frame = cap.read()
-        if frame is None: break
-        grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frames.append(grey)
-
-        # Optionally show video
-        if not showVideo: continue
-        cv2.imshow('frame', grey)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if hz is not None: sleep(1/hz)
-    cap.release()
-    cv2.waitKey(0)
+    total = None
+    count = 0
+    def accumulate(grey):
+        nonlocal total, count
+        if not streaming:
+            frames.append(grey)
+        elif total is None:
+            total = grey.astype(np.float64)
+        else:
+            np.add(total, grey, out=total)
+        count += 1
+        return grey
+
+    # Optionally show video, accumulating on the playback thread
+    source = framesource.readFrames(path, workers=workers)
+    if showVideo:
+        print(playback.play(source, accumulate, 'frame', fps=hz))
+        cv2.waitKey(0)
+    else:
+        for grey in source: accumulate(grey)
+    source.close()
     
     # Final compute using numpy
-    avg = np.mean(frames, axis=0).astype('uint8')
+    if streaming:
+        avg = (total / count).astype('uint8')
+    else:
+        avg = np.mean(frames, axis=0).astype('uint8')
     if showVideo:
         cv2.imshow('frame', avg)
 
@@ -52,6 +76,108 @@ def averageBackground(path="frames", showVideo=False, usePathPrefix=True, hz=Non
     return avg
 
 
+def tilePercentile(stackFile, tile, percentile=50, chunkFrames=256, frames=None):
+    """Finds the per-pixel percentile of one tile of a memory-mapped frame stack using
+    a 256 bin histogram per pixel, reading only chunkFrames frames of the tile at once.
+
+    Args:
+        stackFile (str): The .npy file holding the (N, H, W) uint8 frame stack.
+        tile (tuple): The y0, y1, x0, x1 bounds of the tile.
+        percentile (float, optional): The percentile to find, 50 for the median. Defaults to 50.
+        chunkFrames (int, optional): The most frames read at once. Defaults to 256.
+        frames (int, optional): Only use this many frames from the start of the stack.
+            Defaults to the whole stack.
+
+    Returns:
+        The uint8 percentile image of the tile.
+    """
+    y0, y1, x0, x1 = tile
+    stack = np.load(stackFile, mmap_mode='r')
+    if frames is not None: stack = stack[:frames]
+    count = stack.shape[0]
+    pixels = (y1 - y0) * (x1 - x0)
+
+    # Bin every pixel's values over time
+    offsets = np.arange(pixels, dtype=np.intp) * 256
+    histograms = np.zeros(pixels * 256, dtype=np.int64)
+    for start in range(0, count, chunkFrames):
+        chunk = stack[start:start+chunkFrames, y0:y1, x0:x1].reshape(-1, pixels)
+        histograms += np.bincount((chunk + offsets).ravel(), minlength=pixels * 256)
+    cumulative = np.cumsum(histograms.reshape(pixels, 256), axis=1)
+
+    # Interpolate between the two nearest ranks, like np.percentile
+    rank = (percentile / 100) * (count - 1)
+    low = np.argmax(cumulative > np.floor(rank), axis=1)
+    high = np.argmax(cumulative > np.ceil(rank), axis=1)
+    values = low + (high - low) * (rank - np.floor(rank))
+
+    return values.reshape(y1 - y0, x1 - x0).astype('uint8')
+
+
+def percentileBackground(path="frames", percentile=50, usePathPrefix=True, tileSize=64,
+    processes=None, chunkFrames=256, workers=None):
+    """Finds the per-pixel percentile of a set of frames as the greyscale background.
+    The median ignores cars that stop for a while, which ghost into the average.
+
+    The frames are first written to a memory-mapped stack on disk, then the frame is
+    split into tiles that are processed in parallel, each reading only a bounded
+    chunk of the stack at a time.
+
+    Args:
+        path (str, optional): The directory to load the frames from. Defaults to "frames".
+        percentile (float, optional): The percentile to find, 50 for the median. Defaults to 50.
+        usePathPrefix (bool, optional): Use the path prefix of the module. Defaults to True.
+        tileSize (int, optional): The side length of each tile. Defaults to 64.
+        processes (int, optional): The number of tile processes. Defaults to one per core.
+        chunkFrames (int, optional): The most frames of a tile read at once. Defaults to 256.
+        workers (int, optional): Decode the frames in a pool of this many threads, 0 for
+            one per core. The pooled decoder changes the frames by a few grey levels, and
+            so the result. Defaults to None.
+
+    Raises:
+        IOError: When no frames could be read.
+
+    Returns:
+        An opencv image.
+    """
+    pathPrefix = os.path.dirname(os.path.realpath(__file__))
+    if usePathPrefix: path = pathPrefix + os.path.sep + path
+
+    count = len(framesource.sequenceFiles(path))
+    handle, stackFile = tempfile.mkstemp(suffix=".npy")
+    os.close(handle)
+    try:
+        # Spill the frames to disk, keeping count of those actually stored
+        stack = None
+        stored = 0
+        for grey in framesource.readFrames(path, workers=workers):
+            if stored >= count: break
+            if stack is None:
+                stack = np.lib.format.open_memmap(stackFile, mode='w+', dtype=np.uint8,
+                    shape=(count,) + grey.shape)
+            stack[stored] = grey
+            stored += 1
+        if stack is None:
+            raise IOError("No frames could be read from \"" + path + "\".")
+        height, width = stack.shape[1:]
+        stack.flush()
+        del stack
+
+        # Work through the tiles in parallel
+        tiles = [(y, min(y + tileSize, height), x, min(x + tileSize, width))
+            for y in range(0, height, tileSize) for x in range(0, width, tileSize)]
+        background = np.empty((height, width), dtype=np.uint8)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = pool.map(tilePercentile, [stackFile] * len(tiles), tiles,
+                [percentile] * len(tiles), [chunkFrames] * len(tiles), [stored] * len(tiles))
+            for (y0, y1, x0, x1), values in zip(tiles, results):
+                background[y0:y1, x0:x1] = values
+    finally:
+        os.remove(stackFile)
+
+    return background
+
+
 def main():
     """
     The main function of the module.
@@ -62,13 +188,26 @@ def main():
         help="The directory to load the video frames from.")
     parser.add_argument("outfile", nargs="?", type=str, default="p2-output.png", \
         help="The file to write the output image to.")
+    parser.add_argument("--workers", nargs="?", type=int, default=None, const=0, \
+        help="Decode the frames in a pool of this many threads (one per core if no count is " + \
+        "given). The pooled decoder changes the frames slightly, and so the results.")
+    parser.add_argument("--percentile", nargs="?", type=float, default=None, const=50, \
+        help="Use this per-pixel percentile of the frames (the median if no value is given) " + \
+        "instead of the average.")
     args = parser.parse_args()
 
     avg = None
-    if args.indir is None:
-        avg = averageBackground(showVideo=True, hz=24)
+    if args.percentile is not None:
+        if args.indir is None:
+            avg = percentileBackground(percentile=args.percentile, workers=args.workers)
+        else:
+            avg = percentileBackground(path=args.indir, percentile=args.percentile,
+                usePathPrefix=False, workers=args.workers)
+    elif args.indir is None:
+        avg = averageBackground(showVideo=True, hz=24, workers=args.workers)
     else:
-        avg = averageBackground(path=args.indir, showVideo=True, usePathPrefix=False, hz=24)
+        avg = averageBackground(path=args.indir, showVideo=True, usePathPrefix=False, hz=24,
+            workers=args.workers)
 
     cv2.imwrite(args.outfile, avg)
     return
@@ -2,9 +2,12 @@
 Uses the work done in modules part2 and part1 to create a background difference
 calculation.
 """
+import os
 import argparse
 import cv2
+import numpy as np
 
+import bgcache
 import part1
 import part2
 
@@ -28,15 +31,289 @@ def backgroundDifference(targetImg, backgroundImg, threshVal=127, useGauss=True)
     """
     absDiff = cv2.absdiff(targetImg, backgroundImg)
     _, threshImg = cv2.threshold(absDiff, threshVal, 255, cv2.THRESH_BINARY)
+    _, otsuImg = otsuDifference(absDiff, useGauss=useGauss)
 
-    otsuImg = None
+    return absDiff, threshImg, otsuImg
+
+def otsuDifference(absDiff, useGauss=True):
+    """Thresholds a difference image with Otsu's method.
+
+    Args:
+        absDiff (cv2.Mat): The absolute difference image.
+        useGauss (bool, optional): Apply a gaussian blur to the image prior to 
+            using Otsu's method. Defaults to True.
+
+    Returns:
+        The threshold Otsu's method picked and the threshold image.
+    """
     if useGauss:
         blur = cv2.GaussianBlur(absDiff, (7, 7), 0)
-        _, otsuImg = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+        return cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+
+    return cv2.threshold(absDiff, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+
+def boxTiles(boxes, margin, shape, tileSize=32):
+    """Marks the tiles of a grid that fall within a margin of any box.
+
+    Args:
+        boxes (list): The (x, y, w, h) boxes.
+        margin (int): How far past each box to mark, in pixels.
+        shape (tuple): The height and width of the image.
+        tileSize (int, optional): The side length of each tile. Defaults to 32.
+
+    Returns:
+        The uint8 tile mask, one element per tile.
+    """
+    rows = -(-shape[0] // tileSize)
+    cols = -(-shape[1] // tileSize)
+    tiles = np.zeros((rows, cols), dtype=np.uint8)
+    for x, y, w, h in boxes:
+        x0 = max(0, x - margin) // tileSize
+        y0 = max(0, y - margin) // tileSize
+        x1 = min(shape[1] - 1, x + w + margin) // tileSize
+        y1 = min(shape[0] - 1, y + h + margin) // tileSize
+        tiles[y0:y1+1, x0:x1+1] = 1
+
+    return tiles
+
+def tileWindows(tiles, shape, tileSize=32):
+    """Merges touching marked tiles into rectangular windows.
+
+    Args:
+        tiles (np.ndarray): The uint8 tile mask.
+        shape (tuple): The height and width of the image.
+        tileSize (int, optional): The side length of each tile. Defaults to 32.
+
+    Returns:
+        A list of (x, y, w, h) windows clipped to the image.
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats(tiles, connectivity=8)
+
+    windows = []
+    for x, y, w, h, _ in stats[1:].tolist():
+        x, y = x * tileSize, y * tileSize
+        w = min(w * tileSize, shape[1] - x)
+        h = min(h * tileSize, shape[0] - y)
+        windows.append((x, y, w, h))
+
+    return windows
+
+def roiBackgroundDifference(targetImg, backgroundImg, windows, otsuThresh, useGauss=True):
+    """Thresholds the difference between the target and background image only inside
+    the given windows, using an Otsu threshold picked earlier on a full frame. Every
+    pixel outside the windows is background.
+
+    Args:
+        targetImg (cv2.Mat): The target image to compare against the background.
+        backgroundImg (cv2.Mat): The background image to compare against.
+        windows (list): The (x, y, w, h) windows to difference.
+        otsuThresh (float): The threshold to apply to the difference.
+        useGauss (bool, optional): Apply a gaussian blur to the windows prior to 
+            thresholding. Defaults to True.
+
+    Returns:
+        The threshold image.
+    """
+    height, width = targetImg.shape[:2]
+    pad = 3 if useGauss else 0
+    otsuImg = np.zeros_like(targetImg)
+    for x, y, w, h in windows:
+        # Take enough of a halo for the blur to match the full frame
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        diff = cv2.absdiff(targetImg[y0:y1, x0:x1], backgroundImg[y0:y1, x0:x1])
+        if useGauss: diff = cv2.GaussianBlur(diff, (7, 7), 0)
+
+        inner = diff[y-y0:y-y0+h, x-x0:x-x0+w]
+        otsuImg[y:y+h, x:x+w][inner > otsuThresh] = 255
+
+    return otsuImg
+
+def pyramidDifference(targetImg, backgroundImg, levels=2, tileSize=32, useGauss=True):
+    """Finds motion on a downsampled copy of the images first, then thresholds the
+    full resolution difference only in the tiles that showed motion. The Otsu
+    threshold is picked at the downsampled level.
+
+    Args:
+        targetImg (cv2.Mat): The target image to compare against the background.
+        backgroundImg (cv2.Mat): The background image to compare against.
+        levels (int, optional): How many times to halve the images. Defaults to 2.
+        tileSize (int, optional): The side length of each full resolution tile, a
+            multiple of 2^levels. Defaults to 32.
+        useGauss (bool, optional): Apply a gaussian blur to the image prior to 
+            using Otsu's method. Defaults to True.
+
+    Returns:
+        The threshold Otsu's method picked and the threshold image.
+    """
+    smallTarget, smallBackground = targetImg, backgroundImg
+    for _ in range(levels):
+        smallTarget = cv2.pyrDown(smallTarget)
+        smallBackground = cv2.pyrDown(smallBackground)
+
+    # Each pyrDown already applies a gaussian, so the coarse level is not blurred again
+    otsuThresh, coarse = otsuDifference(cv2.absdiff(smallTarget, smallBackground),
+        useGauss=useGauss and levels == 0)
+
+    # Max pool the coarse mask onto the tile grid, growing by a tile to catch edges
+    step = max(1, tileSize >> levels)
+    rows = -(-coarse.shape[0] // step)
+    cols = -(-coarse.shape[1] // step)
+    padded = np.zeros((rows * step, cols * step), dtype=np.uint8)
+    padded[:coarse.shape[0], :coarse.shape[1]] = coarse
+    tiles = padded.reshape(rows, step, cols, step).max(axis=(1, 3))
+    tiles = cv2.dilate(tiles, np.ones((3, 3), dtype=np.uint8))
+
+    # Only the tiles that fall inside the full resolution image matter
+    tiles = tiles[:-(-targetImg.shape[0] // tileSize), :-(-targetImg.shape[1] // tileSize)]
+    windows = tileWindows((tiles > 0).astype(np.uint8), targetImg.shape[:2], tileSize=tileSize)
+
+    return otsuThresh, roiBackgroundDifference(targetImg, backgroundImg, windows, otsuThresh,
+        useGauss=useGauss)
+
+def batchHistograms(images, chunkPixels=1 << 24):
+    """Computes the 256 bin histogram of every image in a uint8 stack.
+
+    Args:
+        images (np.ndarray): The (N, H, W) uint8 image stack.
+        chunkPixels (int, optional): The most pixels binned at once, bounding the size
+            of the temporary index array. Defaults to 2^24.
+
+    Returns:
+        The (N, 256) histograms.
+    """
+    count = images.shape[0]
+    flat = images.reshape(count, -1)
+    histograms = np.empty((count, 256), dtype=np.int64)
+    step = max(1, chunkPixels // max(1, flat.shape[1]))
+    for start in range(0, count, step):
+        chunk = flat[start:start+step]
+        offsets = np.arange(chunk.shape[0], dtype=np.intp)[:, None] * 256
+        bins = np.bincount((chunk + offsets).ravel(), minlength=chunk.shape[0]*256)
+        histograms[start:start+step] = bins.reshape(-1, 256)
+
+    return histograms
+
+def otsuThresholds(histograms):
+    """Finds the threshold Otsu's method picks for each histogram, matching OpenCV.
+
+    Args:
+        histograms (np.ndarray): The (N, 256) histograms.
+
+    Returns:
+        The (N,) thresholds. Pixels strictly above a threshold are foreground.
+    """
+    histograms = np.atleast_2d(histograms)
+    total = histograms.sum(axis=1, keepdims=True)
+    p = histograms / np.maximum(total, 1)
+    levels = np.arange(256)
+
+    # Between class variance of every split, skipping splits with an empty side
+    q1 = np.cumsum(p, axis=1)
+    q2 = 1 - q1
+    m1 = np.cumsum(p * levels, axis=1)
+    mu = m1[:, -1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu1 = m1 / q1
+        mu2 = (mu - m1) / q2
+        sigma = q1 * q2 * (mu1 - mu2)**2
+    eps = np.finfo(np.float32).eps
+    valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1 - eps)
+    sigma[~valid] = 0
+
+    return np.argmax(sigma, axis=1)
+
+def batchBackgroundDifference(targetImgs, backgroundImg, threshVal=127, useGauss=True, out=None):
+    """The same as backgroundDifference, but over a whole stack of images at once.
+    The Otsu thresholds of every image come from one set of vectorized histograms.
+
+    Args:
+        targetImgs (np.ndarray): The (N, H, W) uint8 images to compare against the background.
+        backgroundImg (cv2.Mat): The background image to compare against.
+        threshVal (int, optional): The threshold value for the binary mask. Defaults to 127.
+        useGauss (bool, optional): Apply a gaussian blur to the images prior to 
+            using Otsu's method. Defaults to True.
+        out (tuple, optional): Three (N, H, W) uint8 buffers to write the results into,
+            reused between calls. Defaults to None.
+
+    Returns:
+        The stacked absolute differences, threshold images, and threshold images using
+        Otsu's method.
+    """
+    if out is None:
+        out = tuple(np.empty_like(targetImgs, dtype=np.uint8) for _ in range(3))
+    absDiffs, threshImgs, otsuImgs = (buffer[:len(targetImgs)] for buffer in out)
+
+    # The Otsu buffer doubles as scratch space until it is needed
+    np.maximum(targetImgs, backgroundImg, out=absDiffs)
+    np.minimum(targetImgs, backgroundImg, out=otsuImgs)
+    np.subtract(absDiffs, otsuImgs, out=absDiffs)
+
+    np.greater(absDiffs, threshVal, out=threshImgs.view(bool))
+    threshImgs *= 255
+
+    if useGauss:
+        for i in range(len(absDiffs)):
+            cv2.GaussianBlur(absDiffs[i], (7, 7), 0, dst=otsuImgs[i])
     else:
-        _, otsuImg = cv2.threshold(absDiff, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+        np.copyto(otsuImgs, absDiffs)
+    thresholds = otsuThresholds(batchHistograms(otsuImgs))
+    np.greater(otsuImgs, thresholds[:, None, None], out=otsuImgs.view(bool))
+    otsuImgs *= 255
 
-    return absDiff, threshImg, otsuImg
+    return absDiffs, threshImgs, otsuImgs
+
+class AdaptiveBackground:
+    """A background model kept as a per-pixel exponential moving average of the
+    frames it has seen, so differences can be taken on a live stream without a
+    pass over the whole video first.
+    """
+
+    def __init__(self, alpha=0.05):
+        """
+        Args:
+            alpha (float, optional): The weight of each new frame in the average. Defaults to 0.05.
+        """
+        self.alpha = alpha
+        self.average = None
+        self.background = None
+
+    def update(self, frame):
+        """Folds a greyscale frame into the background.
+
+        Args:
+            frame (cv2.Mat): The greyscale frame to add.
+
+        Returns:
+            The updated uint8 background image.
+        """
+        if self.average is None:
+            self.average = np.float32(frame)
+            self.background = frame.copy()
+        else:
+            cv2.accumulateWeighted(frame, self.average, self.alpha)
+            np.copyto(self.background, self.average, casting='unsafe')
+
+        return self.background
+
+    def apply(self, frame, threshVal=127, useGauss=True):
+        """Differences a frame against the current background, then folds the frame
+        into the background.
+
+        Args:
+            frame (cv2.Mat): The greyscale frame to compare against the background.
+            threshVal (int, optional): The threshold value for the binary mask. Defaults to 127.
+            useGauss (bool, optional): Apply a gaussian blur to the image prior to 
+                using Otsu's method. Defaults to True.
+
+        Returns:
+            The absolute difference, threshold image, and threshold image using Otsu's method.
+        """
+        if self.background is None: self.update(frame)
+        result = backgroundDifference(frame, self.background, threshVal=threshVal, useGauss=useGauss)
+        self.update(frame)
+
+        return result
 
 def main():
     """
@@ -50,6 +327,8 @@ def main():
         help="The directory to load the video frames from.")
     parser.add_argument("--useGauss", nargs="?", type=bool, default=False, help="Use gaussian " + \
         "blurring prior to using Otsu's method.")
+    parser.add_argument("--noCache", action="store_true", help="Always recompute the " + \
+        "average background instead of loading it from the cache.")
     args = parser.parse_args()
 
     # I know I'm not using the IMREAD_GRAYSCALE option here. I know exactly what it does
@@ -60,10 +339,13 @@ def main():
         sourceImage = part1.greyscaleImg(printShape=True)
     else:
         sourceImage = part1.greyscaleImg(path=args.infile, printShape=True, usePathPrefix=False)
-    if args.indir is None:
-        backgroundImage = part2.averageBackground()
+    indir = args.indir
+    if indir is None:
+        indir = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "frames"
+    if args.noCache:
+        backgroundImage = part2.averageBackground(path=indir, usePathPrefix=False)
     else:
-        backgroundImage = part2.averageBackground(path=args.indir, usePathPrefix=False)
+        backgroundImage = bgcache.cachedBackground(indir)
 
     absDiffImg, threshImg, otsuImg = backgroundDifference(sourceImage, backgroundImage, threshVal=50, useGauss=args.useGauss)
 
@@ -2,78 +2,157 @@
 Checks the accuracy of the 3D projections from the previous parts in the lab.
 """
 
+import sys
+import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 import numpy as np
 
+import cameramodel
+import detectioncache
 import part2
-import part1
 
 OPTIMAL_DISTANCE = 360
 
-def main():
-    """
-    The main function of the file.
+def evaluateVideo(path, calib=None, useCache=True):
+    """Measures the wand length in every frame of a video and compares it to the
+    optimal distance.
+
+    Args:
+        path (str): The file to read the video from.
+        calib (str, optional): The path to the calibration file. Defaults to None.
+        useCache (bool, optional): Replay cached detections instead of decoding the video
+            when they are available. Defaults to True.
+
+    Returns:
+        dict: The video's frame counts, and when the wand was detected, the mean and
+            standard deviation of its length, the mean accuracy, and whether the optimal
+            distance is within a standard deviation of the mean.
     """
-    parser = argparse.ArgumentParser("Checks the accuracy of the projections created " + \
-        "in the previous parts of the lab.")
-    parser.add_argument("infile", nargs=1, type=str, default=None, 
-        help="The file to read the video from.")
-    parser.add_argument("--calib", nargs="?", type=str, default=None,
-        help="An optional way to pass custom calibration parameters.")
-    args = parser.parse_args()
+    result = {"video": path, "frames": 0, "missedFrames": 0, "opened": False}
 
     # Grab data
-    f, cx, cy = part2.readCalib(args.calib)
-    capture = cv2.VideoCapture(str(args.infile[0]))
-    if not capture.isOpened():
-        print("Error opening video file at \"" + str(args.infile[0]) + "\".")
+    camera = cameramodel.loadCamera(calib)
+    f, cx, cy = camera.intrinsics()
+    capture = cv2.VideoCapture(str(path))
+    result["opened"] = capture.isOpened() and capture.read()[0]
+    capture.release()
+    if not result["opened"]: return result
+
+    if useCache:
+        detections = detectioncache.cachedDetections(path, camera=camera)
+    else:
+        detections = detectioncache.detectVideo(path, camera=camera)
     
     # Process data
-    missedFrames = 0
-    frames = 0
-    distances = []
-    while capture.isOpened():
-        ret, src = capture.read()
-        if not ret: break
-        frames += 1
+    pairs = []
+    for circles in detections:
+        result["frames"] += 1
 
         # Find 2 circles in the frame
-        circles, _ = part1.findCircles(src, drawCircles=False)
         if circles is None or len(circles[0, :]) != 2: 
-            missedFrames += 1
+            result["missedFrames"] += 1
             continue
-        circles = circles[0, :]
+        pairs.append(circles[0, :])
 
-        # Compute distance
-        coordA = part2.findCircleWorldCoords(circles[0], f, cx, cy)
-        coordB = part2.findCircleWorldCoords(circles[1], f, cx, cy)
+    # Analyze
+    if len(pairs) == 0: return result
 
-        distance = 0
-        for i in range(3):
-            distance += (coordA[i] - coordB[i])**2
-        distances.append(np.sqrt(distance))
+    distances = part2.circlePairDistances(np.array(pairs), f, cx, cy)
+    mean = float(np.mean(distances))
+    stdDev = float(np.std(distances))
+    result["mean"] = mean
+    result["stdDev"] = stdDev
+    result["accuracy"] = 100 - abs(mean-OPTIMAL_DISTANCE)*100/OPTIMAL_DISTANCE
+    result["withinStdDev"] = (mean+stdDev) >= OPTIMAL_DISTANCE and (mean-stdDev) <= OPTIMAL_DISTANCE
 
-    # Analyze
-    if len(distances) == 0:
-        print("No wand detected.")
+    return result
+
+def evaluateVideos(paths, calib=None, workers=None, useCache=True):
+    """Evaluates many videos at once, one video per worker process.
+
+    Args:
+        paths (list): The files to read the videos from.
+        calib (str, optional): The path to the calibration file. Defaults to None.
+        workers (int, optional): The number of worker processes. Defaults to one per core.
+        useCache (bool, optional): Replay cached detections instead of decoding the videos
+            when they are available. Defaults to True.
+
+    Returns:
+        dict: The result of every video from evaluateVideo, and a summary across them.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(evaluateVideo, paths, [calib] * len(paths),
+            [useCache] * len(paths)))
+
+    detected = [result for result in results if "mean" in result]
+    frames = sum(result["frames"] for result in results)
+    missedFrames = sum(result["missedFrames"] for result in results)
+    summary = {
+        "videos": len(results),
+        "detectedVideos": len(detected),
+        "frames": frames,
+        "missedFrames": missedFrames,
+    }
+    if len(detected) > 0:
+        means = np.array([result["mean"] for result in detected])
+        summary["meanOfMeans"] = float(means.mean())
+        summary["stdDevOfMeans"] = float(means.std())
+        summary["meanAccuracy"] = float(np.mean([result["accuracy"] for result in detected]))
+        summary["withinStdDev"] = sum(result["withinStdDev"] for result in detected)
+
+    return {"optimalDistance": OPTIMAL_DISTANCE, "summary": summary, "results": results}
+
+def main():
+    """
+    The main function of the file.
+    """
+    parser = argparse.ArgumentParser("Checks the accuracy of the projections created " + \
+        "in the previous parts of the lab.")
+    parser.add_argument("infile", nargs="+", type=str, default=None, 
+        help="The file to read the video from. Several files are evaluated in parallel " + \
+        "and reported as JSON.")
+    parser.add_argument("--calib", nargs="?", type=str, default=None,
+        help="An optional way to pass custom calibration parameters.")
+    parser.add_argument("--workers", nargs="?", type=int, default=None,
+        help="The number of videos to evaluate at once. Defaults to one per core.")
+    parser.add_argument("--report", nargs="?", type=str, default=None,
+        help="Write a JSON report to this file (\"-\" for stdout) instead of printing.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the circles instead of replaying cached detections.")
+    args = parser.parse_args()
+
+    # Evaluate many videos into a machine readable report
+    if len(args.infile) > 1 or args.report is not None:
+        report = evaluateVideos(args.infile, calib=args.calib, workers=args.workers,
+            useCache=not args.noCache)
+        if args.report is None or args.report == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.report, 'w') as reportFile:
+                json.dump(report, reportFile, indent=2)
         return
 
-    mean = np.mean(distances)
-    stdDev = np.std(distances)
+    result = evaluateVideo(args.infile[0], calib=args.calib, useCache=not args.noCache)
+    if not result["opened"]:
+        print("Error opening video file at \"" + str(args.infile[0]) + "\".")
+    if "mean" not in result:
+        print("No wand detected.")
+        return
 
     # Display
-    print("Mean: " + str(mean) + "mm")
-    print("Standard Deviation: " + str(stdDev) + "mm")
-    accuracy = 100 - np.abs(mean-OPTIMAL_DISTANCE)*100/OPTIMAL_DISTANCE
-    print("Mean accuracy: %" + str(accuracy))
+    print("Mean: " + str(result["mean"]) + "mm")
+    print("Standard Deviation: " + str(result["stdDev"]) + "mm")
+    print("Mean accuracy: %" + str(result["accuracy"]))
     
-    if (mean+stdDev) >= OPTIMAL_DISTANCE and (mean-stdDev) <= OPTIMAL_DISTANCE:
+    if result["withinStdDev"]:
         print("Within standard deviation.")
     else:
         print("Outside of standard deviation.")
-    print(str(missedFrames) + " out of " + str(frames) + " frames missed.")
+    print(str(result["missedFrames"]) + " out of " + str(result["frames"]) + " frames missed.")
 
 if __name__ == "__main__":
     main()
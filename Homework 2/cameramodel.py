@@ -0,0 +1,134 @@
+"""
+Loads the camera's calibration once and undistorts frames with precomputed maps.
+"""
+
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+DEFAULT_CALIB = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "iphone_calib.txt"
+
+class CameraModel:
+    """The intrinsic matrix and lens distortion of a camera, along with the remap
+    tables that undistort its frames, built once per frame size.
+    """
+
+    def __init__(self, matrix, distortion=None):
+        """
+        Args:
+            matrix (np.ndarray): The 3x3 intrinsic matrix.
+            distortion (np.ndarray, optional): The OpenCV distortion coefficients
+                (k1, k2, p1, p2[, k3...]). Defaults to None.
+        """
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        self.distortion = np.zeros(5) if distortion is None else \
+            np.asarray(distortion, dtype=np.float64)
+        self.maps = {}
+
+    @property
+    def f(self):
+        """float: The focal length."""
+        return self.matrix[0, 0]
+
+    @property
+    def cx(self):
+        """float: The principal point.x."""
+        return self.matrix[0, 2]
+
+    @property
+    def cy(self):
+        """float: The principal point.y."""
+        return self.matrix[1, 2]
+
+    def intrinsics(self):
+        """Gets the simplified intrinsic values used by the projection helpers.
+
+        Returns:
+            f, cx, cy: The focal length and principal point.
+        """
+        return float(self.f), float(self.cx), float(self.cy)
+
+    def undistortMaps(self, width, height):
+        """Gets the remap tables for a frame size, building them on first use.
+
+        Args:
+            width (int): The width of the frames.
+            height (int): The height of the frames.
+
+        Returns:
+            The two fixed point remap tables.
+        """
+        maps = self.maps.get((width, height))
+        if maps is None:
+            # Keep the same intrinsics so the projection math is unchanged
+            maps = cv2.initUndistortRectifyMap(self.matrix, self.distortion, None, self.matrix,
+                (width, height), cv2.CV_16SC2)
+            self.maps[(width, height)] = maps
+
+        return maps
+
+    def undistort(self, frame):
+        """Removes the lens distortion from a frame with a single table lookup.
+
+        Args:
+            frame (cv2.Mat): The frame to undistort.
+
+        Returns:
+            cv2.Mat: The undistorted frame, or the frame itself when there is no distortion.
+        """
+        if not self.distortion.any(): return frame
+
+        map1, map2 = self.undistortMaps(frame.shape[1], frame.shape[0])
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+
+def parseCalib(path):
+    """Reads a calibration file holding "f cx cy", optionally followed by the
+    distortion coefficients "k1 k2 p1 p2 [k3]".
+
+    Args:
+        path (string): The path to the calibration file.
+
+    Returns:
+        CameraModel: The camera described by the file.
+    """
+    with open(path, 'r') as calibFile:
+        values = [float(value) for value in calibFile.read().split()]
+
+    f, cx, cy = values[:3]
+    matrix = np.array([[f, 0, cx], [0, f, cy], [0, 0, 1]])
+    distortion = np.array(values[3:]) if len(values) > 3 else None
+
+    return CameraModel(matrix, distortion)
+
+
+@lru_cache(maxsize=None)
+def loadCachedCamera(path):
+    """Parses a calibration file once per resolved path.
+
+    Args:
+        path (string): The resolved path to the calibration file, so every spelling of a
+            path shares one entry.
+
+    Returns:
+        CameraModel: The camera model cached for this path, shared by every caller and
+            so not to be modified.
+    """
+    return parseCalib(path)
+
+
+def loadCamera(path=None):
+    """Loads the camera model for a calibration file, reading each file only once.
+
+    Args:
+        path (string, optional): The path to the calibration file. Defaults to None.
+
+    Returns:
+        CameraModel: The shared camera model.
+    """
+    if path is None: path = DEFAULT_CALIB
+
+    return loadCachedCamera(os.path.realpath(path))
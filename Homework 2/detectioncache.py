@@ -0,0 +1,140 @@
+"""
+Keeps the circles detected in each frame of a video on disk, keyed by the video and
+the detection parameters, so later scripts can replay them instead of re-detecting.
+"""
+
+import os
+import json
+import hashlib
+from contextlib import suppress
+
+import cv2
+import numpy as np
+
+import part1
+
+
+CACHE_DIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + ".cache"
+FINGERPRINT_BYTES = 1 << 20
+
+def videoFingerprint(path):
+    """Hashes a video's size, modification time, and its first and last megabyte.
+
+    Args:
+        path (str): The video file.
+
+    Returns:
+        The hex digest of the video.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1(("%d %d" % (stat.st_size, stat.st_mtime_ns)).encode())
+    with open(path, 'rb') as video:
+        digest.update(video.read(FINGERPRINT_BYTES))
+        video.seek(max(0, stat.st_size - FINGERPRINT_BYTES))
+        digest.update(video.read(FINGERPRINT_BYTES))
+
+    return digest.hexdigest()
+
+
+def saveDetections(path, detections):
+    """Writes per-frame detections as two columns: the circle count of each frame and
+    every circle of the video back to back.
+
+    Args:
+        path (str): The .npz file to write.
+        detections (list): The circles of each frame in the format of cv2.HoughCircles,
+            or None for frames without any.
+    """
+    counts = np.array([0 if circles is None else circles.shape[1] for circles in detections],
+        dtype=np.int32)
+    found = [circles[0] for circles in detections if circles is not None]
+    circles = np.concatenate(found).astype(np.float32) if len(found) > 0 else \
+        np.empty((0, 3), dtype=np.float32)
+
+    tempFile = path + ".%d.tmp" % os.getpid()
+    with open(tempFile, 'wb') as out:
+        np.savez(out, counts=counts, circles=circles)
+    os.replace(tempFile, path)
+
+
+def loadDetections(path):
+    """Reads per-frame detections written by saveDetections.
+
+    Args:
+        path (str): The .npz file to read.
+
+    Returns:
+        list: The circles of each frame in the format of cv2.HoughCircles, or None for
+            frames without any.
+    """
+    with np.load(path) as data:
+        counts = data["counts"]
+        circles = data["circles"]
+
+    ends = np.cumsum(counts)
+    return [None if count == 0 else circles[None, end-count:end] for count, end in zip(counts, ends)]
+
+
+def detectVideo(path, camera=None, **params):
+    """Runs findCircles on every frame of a video.
+
+    Args:
+        path (str): The file to read the video from.
+        camera (cameramodel.CameraModel, optional): Undistort each frame with this camera
+            first. Defaults to None.
+        **params: The detection parameters passed to part1.findCircles.
+
+    Returns:
+        list: The circles of each frame in the format of cv2.HoughCircles, or None.
+    """
+    detections = []
+    capture = cv2.VideoCapture(str(path))
+    while capture.isOpened():
+        ret, src = capture.read()
+        if not ret: break
+
+        if camera is not None: src = camera.undistort(src)
+        circles, _ = part1.findCircles(src, drawCircles=False, **params)
+        detections.append(circles)
+    capture.release()
+
+    return detections
+
+
+def cachedDetections(path, camera=None, cacheDir=CACHE_DIR, **params):
+    """Loads the circles detected in each frame of a video from the cache, detecting
+    and storing them first if the video or parameters have changed.
+
+    Args:
+        path (str): The file to read the video from.
+        camera (cameramodel.CameraModel, optional): Undistort each frame with this camera
+            first. Defaults to None.
+        cacheDir (str, optional): The directory to keep cached detections in. Defaults
+            to ".cache" beside this module.
+        **params: The detection parameters passed to part1.findCircles.
+
+    Returns:
+        list: The circles of each frame in the format of cv2.HoughCircles, or None.
+    """
+    key = dict(part1.DETECTION_DEFAULTS, **params)
+    if camera is not None and camera.distortion.any():
+        key["matrix"] = camera.matrix.tolist()
+        key["distortion"] = camera.distortion.tolist()
+    video = json.dumps([os.path.realpath(path), key], sort_keys=True)
+    video = hashlib.sha1(video.encode()).hexdigest()[:16]
+    cacheFile = cacheDir + os.path.sep + video + "-" + videoFingerprint(path) + ".npz"
+    if os.path.isfile(cacheFile):
+        return loadDetections(cacheFile)
+
+    detections = detectVideo(path, camera=camera, **params)
+
+    # Drop stale entries for this video and parameters
+    os.makedirs(cacheDir, exist_ok=True)
+    for name in os.listdir(cacheDir):
+        if name.startswith(video + "-") and name.endswith(".npz"):
+            # Another process may have removed it first
+            with suppress(FileNotFoundError):
+                os.remove(cacheDir + os.path.sep + name)
+    saveDetections(cacheFile, detections)
+
+    return detections
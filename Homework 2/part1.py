@@ -2,19 +2,37 @@
 Detects circles in a video.
 """
 
-from time import sleep
 import argparse
 
 import cv2
 import numpy as np
 
+import playback
 
-def findCircles(sourceImage, drawCircles=True):
+
+DETECTION_DEFAULTS = dict(blurSize=9, minDist=None, param1=100, param2=32, scale=1., refine=False)
+REFINE_RAYS = 32
+REFINE_RANGE = 0.3
+REFINE_STEP = 0.25
+SUPPORT_SAMPLES = 64
+
+def findCircles(sourceImage, drawCircles=True, blurSize=9, minDist=None, param1=100, param2=32,
+    scale=1., refine=False):
     """Finds circles in an image, then optionally draws them to said image.
 
     Args:
         sourceImage (cv2.Mat): The image to analyze.
         drawCircles (bool, optional): Draw the detected circles. Defaults to True.
+        blurSize (int, optional): The size of the gaussian blur kernel. Defaults to 9.
+        minDist (float, optional): The minimum distance between circle centers. Defaults
+            to a sixteenth of the image width.
+        param1 (float, optional): The upper Canny threshold for HoughCircles. Defaults to 100.
+        param2 (float, optional): The accumulator threshold for HoughCircles. Defaults to 32.
+        scale (float, optional): Blur and search a copy of the image resized by this factor,
+            mapping the circles back to full resolution. param2 counts votes at the searched
+            scale, so shrunken searches usually want a lower one. Defaults to 1.
+        refine (bool, optional): Refine each radius to sub-pixel accuracy on the full
+            resolution image. Defaults to False.
 
     Returns:
         circles, copiedImage: The detected circles and the optionally drawn to 
@@ -24,30 +42,263 @@ def findCircles(sourceImage, drawCircles=True):
 
     # Requirement 2
     grey = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-    frame = cv2.GaussianBlur(grey, (9, 9), sigmaX=2, sigmaY=2)
+    frame = grey
+    if scale != 1:
+        # Shrink the blur along with the image
+        frame = cv2.resize(grey, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        blurSize = max(3, int(round(blurSize * scale)) | 1)
+        if minDist is not None: minDist *= scale
+    frame = cv2.GaussianBlur(frame, (blurSize, blurSize), sigmaX=2*min(scale, 1), sigmaY=2*min(scale, 1))
 
     # Requirement 3
-    # Note: I changed param2 to 32 due to the videos not having the best centers.
-    #       There's a lot of reflection and motion on the balls, so this little bit
-    #       helps with blocking out poor detections.
-    circles = cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, 1, frame.shape[1]/16, 
-        param1=100, param2=32)
+    circles = houghCircles(frame, minDist=minDist, param1=param1, param2=param2)
+    if circles is not None and scale != 1:
+        # Pixel centers sit half a pixel in from the edges at both scales
+        circles[..., :2] = (circles[..., :2] + 0.5) / scale - 0.5
+        circles[..., 2] /= scale
+    if circles is not None and refine:
+        for circle in circles[0]:
+            circle[2] = refineCircleRadius(grey, circle)
 
     # Requirement 4
     if circles is not None and drawCircles:
-        circles = np.uint16(np.around(circles))
-        for n in circles[0, :]:
-            # Draw circle center
-            center = (n[0], n[1])
-            cv2.circle(src, center, 1, (0, 255, 255), 3)
-
-            # Draw outlining circle
-            radius = n[2]
-            cv2.circle(src, center, radius, (0, 255, 0), 3)
+        circles = drawDetectedCircles(src, circles)
     
     return circles, src
 
 
+def houghCircles(frame, minDist=None, param1=100, param2=32):
+    """Runs the Hough circle transform on an already blurred greyscale frame.
+
+    Args:
+        frame (cv2.Mat): The blurred greyscale frame.
+        minDist (float, optional): The minimum distance between circle centers. Defaults
+            to a sixteenth of the frame width.
+        param1 (float, optional): The upper Canny threshold. Defaults to 100.
+        param2 (float, optional): The accumulator threshold. Defaults to 32.
+
+    Returns:
+        The circles in the format of cv2.HoughCircles, or None.
+    """
+    # Note: I changed param2 to 32 due to the videos not having the best centers.
+    #       There's a lot of reflection and motion on the balls, so this little bit
+    #       helps with blocking out poor detections.
+    if minDist is None: minDist = frame.shape[1]/16
+    return cv2.HoughCircles(frame, cv2.HOUGH_GRADIENT, 1, minDist, 
+        param1=param1, param2=param2)
+
+
+def refineCircleRadius(grey, circle, rays=REFINE_RAYS, searchRange=REFINE_RANGE,
+    step=REFINE_STEP):
+    """Refines the radius of a detected circle to sub-pixel accuracy by finding the
+    strongest edge along rays cast from its center.
+
+    Args:
+        grey (cv2.Mat): The full resolution greyscale image.
+        circle (np.ndarray): The x, y, radius of the circle.
+        rays (int, optional): The number of rays to cast. Defaults to 32.
+        searchRange (float, optional): How far from the radius to search, as a fraction
+            of the radius. Defaults to 0.3.
+        step (float, optional): The distance between samples along each ray in pixels.
+            Defaults to 0.25.
+
+    Returns:
+        float: The refined radius, or the original radius when no edge is found.
+    """
+    x, y, r = (float(value) for value in circle)
+    radii = np.arange(r * (1 - searchRange), r * (1 + searchRange), step, dtype=np.float32)
+    if len(radii) < 3: return r
+
+    # Sample a lightly blurred patch around the circle along every ray
+    reach = int(np.ceil(radii[-1])) + 2
+    x0, y0 = max(0, int(x) - reach), max(0, int(y) - reach)
+    patch = grey[y0:int(y) + reach + 1, x0:int(x) + reach + 1]
+    patch = np.float32(cv2.GaussianBlur(patch, (3, 3), 0))
+    angles = np.linspace(0, 2 * np.pi, rays, endpoint=False, dtype=np.float32)
+    mapX = (x - x0 + np.cos(angles)[:, None] * radii[None, :]).astype(np.float32)
+    mapY = (y - y0 + np.sin(angles)[:, None] * radii[None, :]).astype(np.float32)
+
+    # Samples off the image read as -1, which only a float patch can hold
+    profiles = cv2.remap(patch, mapX, mapY, cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=-1)
+
+    # Strongest edge of each ray, interpolated with a parabola
+    gradient = np.abs(np.diff(profiles, axis=1))
+    valid = (profiles[:, :-1] >= 0) & (profiles[:, 1:] >= 0)
+    gradient[~valid] = 0
+    peak = np.clip(np.argmax(gradient, axis=1), 1, gradient.shape[1] - 2)
+    index = np.arange(rays)
+    left, centre, right = gradient[index, peak - 1], gradient[index, peak], gradient[index, peak + 1]
+    denominator = left - 2 * centre + right
+    offset = np.where(denominator < 0, 0.5 * (left - right) / np.where(denominator < 0,
+        denominator, 1), 0)
+    edges = radii[0] + (peak + 0.5 + offset) * step
+    edges = edges[centre > 0]
+    if len(edges) == 0: return r
+
+    return float(np.median(edges))
+
+
+def drawDetectedCircles(image, circles):
+    """Draws detected circles and their centers onto an image in place.
+
+    Args:
+        image (cv2.Mat): The image to draw on.
+        circles (np.ndarray): The (1, N, 3) circles in the format of cv2.HoughCircles.
+
+    Returns:
+        np.ndarray: The circles rounded to whole pixels.
+    """
+    circles = np.uint16(np.around(circles))
+    for n in circles[0, :]:
+        # Draw circle center
+        center = (int(n[0]), int(n[1]))
+        cv2.circle(image, center, 1, (0, 255, 255), 3)
+
+        # Draw outlining circle
+        radius = int(n[2])
+        cv2.circle(image, center, radius, (0, 255, 0), 3)
+
+    return circles
+
+
+def edgeSupport(edges, circle, samples=SUPPORT_SAMPLES):
+    """Measures how much of a circle's outline lies on an edge.
+
+    Args:
+        edges (np.ndarray): The edge image, non-zero on edges.
+        circle (np.ndarray): The x, y, radius of the circle in the edge image.
+        samples (int, optional): The number of points to check around the outline.
+            Defaults to 64.
+
+    Returns:
+        float: The fraction of the outline on an edge, counting points outside the
+            image as off the edge.
+    """
+    x, y, r = (float(value) for value in circle)
+    angles = np.linspace(0, 2 * np.pi, samples, endpoint=False)
+    xs = np.round(x + r * np.cos(angles)).astype(int)
+    ys = np.round(y + r * np.sin(angles)).astype(int)
+    inside = (xs >= 0) & (ys >= 0) & (xs < edges.shape[1]) & (ys < edges.shape[0])
+
+    return np.count_nonzero(edges[ys[inside], xs[inside]]) / samples
+
+
+class CircleTracker:
+    """Tracks circles between frames, predicting where each will be with a constant
+    velocity and searching only a small window around each prediction. Each windowed
+    hit must stay near its prediction and lie on real edges, otherwise the tracks are
+    dropped and the full frame is searched at once, as it is whenever a circle is lost.
+    """
+
+    def __init__(self, windowScale=2., margin=8, radiusTolerance=0.3, refreshInterval=30,
+        maxOffset=0.5, minSupport=0.3):
+        """
+        Args:
+            windowScale (float, optional): The half size of each search window in radii.
+                Defaults to 2.
+            margin (int, optional): Extra pixels added around each search window. Defaults to 8.
+            radiusTolerance (float, optional): How much the radius may change between
+                frames, as a fraction of the radius. Defaults to 0.3.
+            refreshInterval (int, optional): Search the full frame every this many frames
+                to pick up new circles. Defaults to 30.
+            maxOffset (float, optional): How far a hit may be from the predicted center,
+                in radii. Defaults to 0.5.
+            minSupport (float, optional): The fraction of a hit's outline that must lie on
+                a Canny edge. Defaults to 0.3.
+        """
+        self.windowScale = windowScale
+        self.margin = margin
+        self.radiusTolerance = radiusTolerance
+        self.refreshInterval = refreshInterval
+        self.maxOffset = maxOffset
+        self.minSupport = minSupport
+        self.circles = None
+        self.velocities = None
+        self.framesSinceSearch = 0
+
+    def fullSearch(self, sourceImage, predicted=None):
+        """Searches the full frame, carrying over the velocity of any circle that is
+        close to a prediction.
+
+        Args:
+            sourceImage (cv2.Mat): The BGR frame to search.
+            predicted (np.ndarray, optional): The (K, 3) predicted circles. Defaults to None.
+
+        Returns:
+            The circles in the format of cv2.HoughCircles, or None.
+        """
+        circles, _ = findCircles(sourceImage, drawCircles=False)
+        self.framesSinceSearch = 0
+        if circles is None:
+            self.circles = None
+            self.velocities = None
+            return None
+
+        found = circles[0, :].astype(np.float64)
+        velocities = np.zeros((len(found), 2))
+        if predicted is not None and len(predicted) > 0:
+            offsets = found[:, None, :2] - predicted[None, :, :2]
+            distances = np.linalg.norm(offsets, axis=2)
+            nearest = np.argmin(distances, axis=1)
+            close = distances[np.arange(len(found)), nearest] < predicted[nearest, 2] * 2
+            previous = predicted[nearest, :2] - self.velocities[nearest]
+            velocities[close] = found[close, :2] - previous[close]
+
+        self.circles = found
+        self.velocities = velocities
+        return circles
+
+    def update(self, sourceImage):
+        """Finds the tracked circles in the next frame.
+
+        Args:
+            sourceImage (cv2.Mat): The BGR frame to search.
+
+        Returns:
+            The circles in the format of cv2.HoughCircles, or None.
+        """
+        if self.circles is None or self.framesSinceSearch >= self.refreshInterval:
+            return self.fullSearch(sourceImage)
+        self.framesSinceSearch += 1
+
+        predicted = self.circles.copy()
+        predicted[:, :2] += self.velocities
+        height, width = sourceImage.shape[:2]
+        found = np.empty_like(predicted)
+        for i, (x, y, r) in enumerate(predicted):
+            # Crop a window around the prediction
+            half = int(self.windowScale * r + np.abs(self.velocities[i]).max() + self.margin)
+            x0, y0 = max(0, int(x) - half), max(0, int(y) - half)
+            x1, y1 = min(width, int(x) + half + 1), min(height, int(y) + half + 1)
+            if x1 - x0 < 2 * r or y1 - y0 < 2 * r:
+                return self.fullSearch(sourceImage, predicted)
+
+            grey = cv2.cvtColor(sourceImage[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            window = cv2.GaussianBlur(grey, (9, 9), sigmaX=2, sigmaY=2)
+            circles = cv2.HoughCircles(window, cv2.HOUGH_GRADIENT, 1, max(window.shape), 
+                param1=100, param2=32, minRadius=int(r * (1 - self.radiusTolerance)),
+                maxRadius=int(np.ceil(r * (1 + self.radiusTolerance))))
+            if circles is None: return self.fullSearch(sourceImage, predicted)
+
+            # Check the hit against the prediction and the edges HoughCircles voted with
+            hit = circles[0, 0]
+            offset = np.hypot(hit[0] + x0 - x, hit[1] + y0 - y)
+            edges = cv2.Canny(window, 50, 100)
+            if offset > self.maxOffset * r + self.margin or \
+                abs(hit[2] - r) > self.radiusTolerance * r or \
+                edgeSupport(cv2.dilate(edges, None), hit) < self.minSupport:
+                return self.fullSearch(sourceImage, predicted)
+
+            found[i] = hit
+            found[i, 0] += x0
+            found[i, 1] += y0
+
+        self.velocities = found[:, :2] - self.circles[:, :2]
+        self.circles = found
+        return found[None, :, :].astype(np.float32)
+
+
 def main():
     """
     The main function for Part 1.
@@ -59,6 +310,8 @@ def main():
         help="The file to read the video from.")
     parser.add_argument("--fps", nargs="?", type=np.uint16, default=30,
         help="The FPS to display the processed video at.")
+    parser.add_argument("--track", action="store_true",
+        help="Track the circles between frames, only searching near where each is expected.")
     args = parser.parse_args()
 
     # Grab data
@@ -68,19 +321,22 @@ def main():
         print("Error opening video file at \"" + str(args.infile[0]) + "\".")
     
     # Process and display data
-    while capture.isOpened():
-        ret, src = capture.read()
-        if not ret: break
-
-        _, resultImg = findCircles(src, drawCircles=True)
+    tracker = CircleTracker() if args.track else None
+    def processFrame(src):
+        if tracker is None:
+            _, resultImg = findCircles(src, drawCircles=True)
+        else:
+            circles = tracker.update(src)
+            resultImg = src
+            if circles is not None: drawDetectedCircles(resultImg, circles)
+        return resultImg
 
-        # Display
-        cv2.imshow("part1", resultImg)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        sleep(1/args.fps)
-    capture.release()
+    # Display
+    stats = playback.play(playback.readVideo(capture), processFrame, "part1", fps=float(args.fps),
+        dropLate=True)
     
     if showVideo:
+        print(stats)
         cv2.waitKey(0)
         cv2.destroyWindow("part1")
 
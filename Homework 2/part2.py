@@ -3,20 +3,22 @@ Uses detected spheres in a video to make estimations
 on positioning.
 """
 
-import os
-from time import sleep
 import argparse
 
 import cv2
 import numpy as np
 
+import cameramodel
+import detectioncache
 import part1
+import playback
 
 
 BALL_RADIUS_MM = 30
 
 def convertToCameraCoords(x, y, f, cx, cy):
-    """Converts image coordinates to camera coordinates.
+    """Converts image coordinates to camera coordinates. Also works element-wise on
+    arrays of coordinates.
 
     Args:
         x (float): x in image coordinates.
@@ -35,7 +37,8 @@ def convertToCameraCoords(x, y, f, cx, cy):
 
 
 def readCalib(path=None):
-    """Reads the calibration file for the camera used to take the videos.
+    """Reads the calibration file for the camera used to take the videos. The file is
+    only parsed once, see cameramodel.loadCamera for the full camera model.
 
     Args:
         path (string, optional): The path to the calibration file. Defaults to None.
@@ -43,19 +46,7 @@ def readCalib(path=None):
     Returns:
         f, cx, cy: Returns the camera's simplified intrinsic values.
     """
-    if path is None:
-        path = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "iphone_calib.txt"
-
-    calibFile = open(path, 'r')
-    line = calibFile.readline()
-    calibFile.close()
-
-    values = line.split(' ')
-    f = float(values[0])
-    cx = float(values[1])
-    cy = float(values[2])
-
-    return f, cx, cy
+    return cameramodel.loadCamera(path).intrinsics()
 
 
 def findCircleWorldCoords(circle, f, cx, cy):
@@ -73,6 +64,45 @@ def findCircleWorldCoords(circle, f, cx, cy):
     return X, Y, Z
 
 
+def findCirclesWorldCoords(circles, f, cx, cy):
+    """Finds the world coordinates of many circles at once.
+
+    Args:
+        circles (np.ndarray): The (N, 3) x, y, radius of each circle in image coordinates.
+        f (float): The focal length.
+        cx (float): The principal point.x.
+        cy (float): The principal point.y.
+
+    Returns:
+        np.ndarray: The (N, 3) X, Y, Z world coordinates of each circle.
+    """
+    circles = np.asarray(circles, dtype=np.float64).reshape(-1, 3)
+    coords = np.empty_like(circles)
+    coords[:, 2] = f * (BALL_RADIUS_MM / circles[:, 2])
+    coords[:, 0] = (circles[:, 0] - cx) / f * coords[:, 2]
+    coords[:, 1] = (circles[:, 1] - cy) / f * coords[:, 2]
+
+    return coords
+
+
+def circlePairDistances(pairs, f, cx, cy):
+    """Finds the world distance between each pair of circles, such as the two ends of
+    the wand in every frame of a video.
+
+    Args:
+        pairs (np.ndarray): The (N, 2, 3) x, y, radius of both circles of each pair.
+        f (float): The focal length.
+        cx (float): The principal point.x.
+        cy (float): The principal point.y.
+
+    Returns:
+        np.ndarray: The (N,) distance between the circles of each pair.
+    """
+    coords = findCirclesWorldCoords(pairs, f, cx, cy).reshape(-1, 2, 3)
+
+    return np.linalg.norm(coords[:, 0] - coords[:, 1], axis=1)
+
+
 def main():
     """
     The main function of the file.
@@ -86,21 +116,30 @@ def main():
         help="The FPS to display the processed video at.")
     parser.add_argument("--calib", nargs="?", type=str, default=None,
         help="An optional way to pass custom calibration parameters.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the circles instead of replaying cached detections.")
     args = parser.parse_args()
 
     # Grab data
-    f, cx, cy = readCalib(args.calib)
+    camera = cameramodel.loadCamera(args.calib)
+    f, cx, cy = camera.intrinsics()
     capture = cv2.VideoCapture(str(args.infile[0]))
     showVideo = capture.isOpened()
     if not showVideo:
         print("Error opening video file at \"" + str(args.infile[0]) + "\".")
     
+    detections = None
+    if showVideo and not args.noCache:
+        detections = detectioncache.cachedDetections(args.infile[0], camera=camera)
+    
     # Process and display data
-    while capture.isOpened():
-        ret, src = capture.read()
-        if not ret: break
-
-        circles, _ = part1.findCircles(src, drawCircles=False)
+    def processFrame(frame):
+        frameIndex, src = frame
+        src = camera.undistort(src)
+        if detections is not None and frameIndex < len(detections):
+            circles = detections[frameIndex]
+        else:
+            circles, _ = part1.findCircles(src, drawCircles=False)
         if circles is not None:
             for circle in circles[0, :]:
                 # Requirements 1 - 3
@@ -108,16 +147,15 @@ def main():
                 _, _, Z = findCircleWorldCoords(circle, f, cx, cy)
 
                 # Requirement 4
-                cv2.putText(src, str(int(Z)) + "mm", (np.int(x), np.int(y)), cv2.FONT_HERSHEY_COMPLEX_SMALL, 
+                cv2.putText(src, str(int(Z)) + "mm", (int(x), int(y)), cv2.FONT_HERSHEY_COMPLEX_SMALL, 
                     1, (0, 255, 0))
-        
-        # Display
-        cv2.imshow("part2", src)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: sleep(1/args.fps)
-    capture.release()
+        return src
+
+    stats = playback.play(enumerate(playback.readVideo(capture)), processFrame, "part2",
+        fps=None if args.fps is None else float(args.fps), dropLate=True)
     
     if showVideo:
+        print(stats)
         cv2.waitKey(0)
         cv2.destroyWindow("part2")
 
@@ -2,16 +2,23 @@
 Draws boxes around the balls detected in the videos, making estimations.
 """
 
-from time import sleep
 import argparse
 
 import cv2
 import numpy as np
 
+import cameramodel
+import detectioncache
 import part2
 import part1
+import playback
 
 
+# Unit cube corners, and the 12 edges joining corners that differ on one axis
+CUBE_CORNERS = np.array([(i, j, k) for i in (-1, 1) for j in (-1, 1) for k in (-1, 1)])
+CUBE_EDGES = np.array([(a, b) for a in range(8) for b in range(a + 1, 8)
+    if np.count_nonzero(CUBE_CORNERS[a] != CUBE_CORNERS[b]) == 1])
+
 def worldToImageCoords(X, Y, Z, f, cx, cy):
     """Convert 3D world coordinates to image coordinates. This also satisfies
     requirement 1.
@@ -59,6 +66,35 @@ def drawProjectedLine(sourceImage, A, B, f, cx, cy, color=(0, 0, 255)):
     return src
 
 
+def drawProjectedCubes(image, centers, halfSize, f, cx, cy, color=(0, 0, 255)):
+    """Draws axis aligned cubes around world coordinate centers onto an image in place.
+    Every corner of every cube is projected at once and all of the edges are drawn
+    with a single polyline call.
+
+    Args:
+        image (cv2.Mat): The image to draw on.
+        centers (np.ndarray): The (N, 3) X, Y, Z world coordinates of each cube's center.
+        halfSize (float): Half the side length of each cube.
+        f (float): The focal length of the camera.
+        cx (float): The principle x-point.
+        cy (float): The principle y-point.
+        color (uint8[3]): The color in BGR to color the projected lines. Defaults to (0, 0, 255).
+
+    Returns:
+        cv2.Mat: The image that has been drawn on.
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    if len(centers) == 0: return image
+
+    corners = centers[:, None, :] + (halfSize * CUBE_CORNERS)[None, :, :]
+    x, y = worldToImageCoords(corners[..., 0], corners[..., 1], corners[..., 2], f, cx, cy)
+    points = np.stack((x, y), axis=-1).astype(np.int32)
+
+    edges = points[:, CUBE_EDGES].reshape(-1, 2, 2)
+    cv2.polylines(image, list(edges), False, color, thickness=1)
+    return image
+
+
 def main():
     """
     The main function of the file.
@@ -71,47 +107,45 @@ def main():
         help="The FPS to display the processed video at.")
     parser.add_argument("--calib", nargs="?", type=str, default=None,
         help="An optional way to pass custom calibration parameters.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the circles instead of replaying cached detections.")
     args = parser.parse_args()
 
     # Grab data
-    f, cx, cy = part2.readCalib(args.calib)
+    camera = cameramodel.loadCamera(args.calib)
+    f, cx, cy = camera.intrinsics()
     capture = cv2.VideoCapture(str(args.infile[0]))
     showVideo = capture.isOpened()
     if not showVideo:
         print("Error opening video file at \"" + str(args.infile[0]) + "\".")
     
+    detections = None
+    if showVideo and not args.noCache:
+        detections = detectioncache.cachedDetections(args.infile[0], camera=camera)
+    
     # Process and display data
-    while capture.isOpened():
-        ret, src = capture.read()
-        if not ret: break
-
-        circles, _ = part1.findCircles(src, drawCircles=False)
+    def processFrame(frame):
+        frameIndex, src = frame
+        src = camera.undistort(src)
+        if detections is not None and frameIndex < len(detections):
+            circles = detections[frameIndex]
+        else:
+            circles, _ = part1.findCircles(src, drawCircles=False)
         if circles is not None:
-            for circle in circles[0, :]:
-                # Requirement 3
-                x, y, _ = circle
-                X, Y, Z = part2.findCircleWorldCoords(circle, f, cx, cy)
-                R = part2.BALL_RADIUS_MM
-
-                for i in range(2):
-                    i = (i * 2) - 1
-                    for j in range(2):
-                        j = (j * 2) - 1
-
-                        src = drawProjectedLine(src, (X+(i*R), Y+(j*R), Z-R), (X+(i*R), Y+(j*R), Z+R), f, cx, cy)
-                        src = drawProjectedLine(src, (X+(i*R), Y-R, Z+(j*R)), (X+(i*R), Y+R, Z+(j*R)), f, cx, cy)
-                        src = drawProjectedLine(src, (X-R, Y+(i*R), Z+(j*R)), (X+R, Y+(i*R), Z+(j*R)), f, cx, cy)
-
-                cv2.putText(src, str(int(Z)) + "mm", (np.int(x), np.int(y)), cv2.FONT_HERSHEY_COMPLEX_SMALL,
+            # Requirement 3
+            coords = part2.findCirclesWorldCoords(circles[0, :], f, cx, cy)
+            drawProjectedCubes(src, coords, part2.BALL_RADIUS_MM, f, cx, cy)
+
+            for (x, y, _), (_, _, Z) in zip(circles[0, :], coords):
+                cv2.putText(src, str(int(Z)) + "mm", (int(x), int(y)), cv2.FONT_HERSHEY_COMPLEX_SMALL,
                     1, (0, 255, 255))
-        
-        # Display
-        cv2.imshow("part3", src)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: sleep(1/args.fps)
-    capture.release()
+        return src
+
+    stats = playback.play(enumerate(playback.readVideo(capture)), processFrame, "part3",
+        fps=None if args.fps is None else float(args.fps), dropLate=True)
 
     if showVideo:
+        print(stats)
         cv2.waitKey(0)
         cv2.destroyWindow("part3")
 
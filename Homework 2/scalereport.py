@@ -0,0 +1,144 @@
+"""
+Reports the speed against depth accuracy trade-off of detecting circles on downscaled
+frames, with and without sub-pixel radius refinement.
+"""
+
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+import cameramodel
+import part1
+import part2
+from bonus import OPTIMAL_DISTANCE
+
+
+def readFrames(path, camera):
+    """Decodes and undistorts every frame of a video.
+
+    Args:
+        path (str): The file to read the video from.
+        camera (cameramodel.CameraModel): Undistorts each frame.
+
+    Returns:
+        list: The frames.
+    """
+    frames = []
+    capture = cv2.VideoCapture(str(path))
+    while capture.isOpened():
+        ret, src = capture.read()
+        if not ret: break
+        frames.append(camera.undistort(src))
+    capture.release()
+
+    return frames
+
+
+def depthDeviation(reference, circles, f):
+    """Measures the relative depth difference of each reference circle against the
+    nearest detected circle within half its radius.
+
+    Args:
+        reference (np.ndarray): The (1, N, 3) full resolution circles.
+        circles (np.ndarray): The (1, M, 3) circles to measure.
+        f (float): The focal length.
+
+    Returns:
+        list: The relative depth difference of each matched circle.
+    """
+    if reference is None or circles is None: return []
+
+    offsets = reference[0][:, None, :2] - circles[0][None, :, :2]
+    distances = np.linalg.norm(offsets, axis=2)
+    nearest = np.argmin(distances, axis=1)
+    matched = distances[np.arange(len(nearest)), nearest] < reference[0][:, 2] / 2
+
+    referenceDepth = f * part2.BALL_RADIUS_MM / reference[0][matched, 2]
+    depth = f * part2.BALL_RADIUS_MM / circles[0][nearest[matched], 2]
+    return list(np.abs(depth - referenceDepth) / referenceDepth)
+
+
+def evaluateScale(frames, reference, scale, param2, refine, f, cx, cy):
+    """Times circle detection at one scale and compares it to the full resolution results.
+
+    Args:
+        frames (list): The frames to search.
+        reference (list): The full resolution circles of each frame.
+        scale (float): The detection scale.
+        param2 (float): The accumulator threshold at the detection scale.
+        refine (bool): Refine each radius at full resolution.
+        f (float): The focal length.
+        cx (float): The principal point.x.
+        cy (float): The principal point.y.
+
+    Returns:
+        dict: The time per frame, missed frames, mean relative depth deviation from full
+            resolution, and mean wand length error.
+    """
+    start = time.perf_counter()
+    detections = [part1.findCircles(src, drawCircles=False, param2=param2, scale=scale,
+        refine=refine)[0] for src in frames]
+    elapsed = time.perf_counter() - start
+
+    deviations = []
+    pairs = []
+    for circles, referenceCircles in zip(detections, reference):
+        deviations += depthDeviation(referenceCircles, circles, f)
+        if circles is not None and circles.shape[1] == 2: pairs.append(circles[0])
+
+    result = {"msPerFrame": elapsed * 1000 / max(1, len(frames)),
+        "missedFrames": len(frames) - len(pairs),
+        "depthDeviation": float(np.mean(deviations)) if len(deviations) > 0 else float('nan'),
+        "lengthError": float('nan')}
+    if len(pairs) > 0:
+        distances = part2.circlePairDistances(np.array(pairs), f, cx, cy)
+        result["lengthError"] = float(np.abs(distances - OPTIMAL_DISTANCE).mean())
+
+    return result
+
+
+def main():
+    """
+    The main function of the file.
+    """
+    videoDir = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + "videos"
+    parser = argparse.ArgumentParser(description="Reports the speed and depth accuracy " + \
+        "of detecting circles on downscaled frames.")
+    parser.add_argument("infile", nargs="*", type=str, default=None,
+        help="The files to read the videos from. Defaults to the bundled videos.")
+    parser.add_argument("--scale", nargs="+", type=float, default=[1, 0.75, 0.5, 0.25],
+        help="The detection scales to compare.")
+    parser.add_argument("--param2", nargs="+", type=float, default=[32],
+        help="The accumulator threshold, either one for every scale or one per scale.")
+    parser.add_argument("--calib", nargs="?", type=str, default=None,
+        help="An optional way to pass custom calibration parameters.")
+    args = parser.parse_args()
+    if len(args.param2) not in (1, len(args.scale)):
+        parser.error("--param2 takes one threshold or one per scale")
+    param2s = args.param2 * len(args.scale) if len(args.param2) == 1 else args.param2
+
+    paths = args.infile
+    if len(paths) == 0:
+        paths = sorted(videoDir + os.path.sep + name for name in os.listdir(videoDir))
+
+    camera = cameramodel.loadCamera(args.calib)
+    f, cx, cy = camera.intrinsics()
+    print("video\tscale\tparam2\trefine\tms/frame\tspeedup\tmissed\tdepth dev\tlength err")
+    for path in paths:
+        frames = readFrames(path, camera)
+        reference = [part1.findCircles(src, drawCircles=False)[0] for src in frames]
+        baseline = None
+        for scale, param2 in zip(args.scale, param2s):
+            for refine in (False, True):
+                result = evaluateScale(frames, reference, scale, param2, refine, f, cx, cy)
+                if baseline is None: baseline = result["msPerFrame"]
+                print("%s\t%g\t%g\t%s\t%.2f\t\t%.1fx\t%d/%d\t%.1f%%\t\t%.1fmm" % (
+                    os.path.basename(path), scale, param2, refine, result["msPerFrame"],
+                    baseline / result["msPerFrame"], result["missedFrames"], len(frames),
+                    result["depthDeviation"] * 100, result["lengthError"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Sweeps the HoughCircles parameters over a set of wand videos, scoring each setting on
+missed frames and how far the measured wand length is from the optimal distance.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import cameramodel
+import part1
+import part2
+from bonus import OPTIMAL_DISTANCE
+
+
+def preprocessVideos(paths, blurSizes, camera, stackDir):
+    """Decodes each video once and appends the blurred greyscale frames for every blur
+    size to a raw stack file that the workers memory-map.
+
+    Args:
+        paths (list): The files to read the videos from.
+        blurSizes (list): The gaussian blur kernel sizes to prepare.
+        camera (cameramodel.CameraModel): Undistorts each frame.
+        stackDir (str): The directory to write the stacks to.
+
+    Returns:
+        dict: The (file, frame shape, frame count) of each video's stack for each blur size.
+    """
+    stacks = {blurSize: [] for blurSize in blurSizes}
+    for videoIndex, path in enumerate(paths):
+        names = [stackDir + os.path.sep + "%d-%d.raw" % (videoIndex, blurSize)
+            for blurSize in blurSizes]
+        files = [open(name, 'wb') for name in names]
+        shape = None
+        frames = 0
+        capture = cv2.VideoCapture(str(path))
+        while capture.isOpened():
+            ret, src = capture.read()
+            if not ret: break
+
+            grey = cv2.cvtColor(camera.undistort(src), cv2.COLOR_BGR2GRAY)
+            shape = grey.shape
+            for blurSize, stackFile in zip(blurSizes, files):
+                stackFile.write(cv2.GaussianBlur(grey, (blurSize, blurSize), sigmaX=2,
+                    sigmaY=2).tobytes())
+            frames += 1
+        capture.release()
+
+        for blurSize, name, stackFile in zip(blurSizes, names, files):
+            stackFile.close()
+            if frames > 0: stacks[blurSize].append((name, shape, frames))
+
+    return stacks
+
+
+def scoreSetting(stackFiles, minDist, param1, param2, f, cx, cy):
+    """Runs HoughCircles with one setting over preprocessed frame stacks.
+
+    Args:
+        stackFiles (list): The (file, frame shape, frame count) of each video's blurred
+            frame stack.
+        minDist (float): The minimum distance between circle centers, or None.
+        param1 (float): The upper Canny threshold.
+        param2 (float): The accumulator threshold.
+        f (float): The focal length.
+        cx (float): The principal point.x.
+        cy (float): The principal point.y.
+
+    Returns:
+        dict: The frame and missed frame counts, and the mean wand length and mean
+            absolute error from the optimal distance over the detected frames.
+    """
+    frames = 0
+    pairs = []
+    for name, shape, count in stackFiles:
+        stack = np.memmap(name, dtype=np.uint8, mode='r', shape=(count,) + shape)
+        for i in range(count):
+            circles = part1.houghCircles(stack[i], minDist=minDist, param1=param1, param2=param2)
+            frames += 1
+            if circles is not None and circles.shape[1] == 2: pairs.append(circles[0])
+
+    result = {"frames": frames, "missedFrames": frames - len(pairs)}
+    if len(pairs) > 0:
+        distances = part2.circlePairDistances(np.array(pairs), f, cx, cy)
+        result["mean"] = float(distances.mean())
+        result["meanError"] = float(np.abs(distances - OPTIMAL_DISTANCE).mean())
+
+    return result
+
+
+def sweep(paths, blurSizes=(9,), minDists=(None,), param1s=(100,), param2s=(32,), calib=None,
+    workers=None):
+    """Scores every combination of HoughCircles parameters over a set of videos. The
+    videos are decoded and blurred once, then the settings are spread across worker
+    processes.
+
+    Args:
+        paths (list): The files to read the videos from.
+        blurSizes (list, optional): The blur kernel sizes to try. Defaults to (9,).
+        minDists (list, optional): The minimum center distances to try, None for a
+            sixteenth of the frame width. Defaults to (None,).
+        param1s (list, optional): The upper Canny thresholds to try. Defaults to (100,).
+        param2s (list, optional): The accumulator thresholds to try. Defaults to (32,).
+        calib (str, optional): The path to the calibration file. Defaults to None.
+        workers (int, optional): The number of worker processes. Defaults to one per core.
+
+    Returns:
+        list: The parameters and score of each setting, best first.
+    """
+    camera = cameramodel.loadCamera(calib)
+    f, cx, cy = camera.intrinsics()
+    stackDir = tempfile.mkdtemp(prefix="sweep-")
+    try:
+        stacks = preprocessVideos(paths, blurSizes, camera, stackDir)
+
+        settings = list(itertools.product(blurSizes, minDists, param1s, param2s))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(scoreSetting, stacks[blurSize], minDist, param1, param2,
+                f, cx, cy) for blurSize, minDist, param1, param2 in settings]
+            results = []
+            for (blurSize, minDist, param1, param2), future in zip(settings, futures):
+                result = dict(blurSize=blurSize, minDist=minDist, param1=param1, param2=param2)
+                result.update(future.result())
+                results.append(result)
+    finally:
+        shutil.rmtree(stackDir)
+
+    results.sort(key=lambda result: (result["missedFrames"], result.get("meanError", np.inf)))
+    return results
+
+
+def main():
+    """
+    The main function of the file.
+    """
+    parser = argparse.ArgumentParser(description="Sweeps the HoughCircles parameters " + \
+        "over wand videos, scoring each setting on missed frames and wand length error.")
+    parser.add_argument("infile", nargs="+", type=str,
+        help="The files to read the videos from.")
+    parser.add_argument("--blurSize", nargs="+", type=int, default=[9],
+        help="The gaussian blur kernel sizes to try, each positive and odd.")
+    parser.add_argument("--minDist", nargs="+", type=float, default=[None],
+        help="The minimum distances between circle centers to try. Defaults to a " + \
+        "sixteenth of the frame width.")
+    parser.add_argument("--param1", nargs="+", type=float, default=[100],
+        help="The upper Canny thresholds to try.")
+    parser.add_argument("--param2", nargs="+", type=float, default=[28, 30, 32, 34, 36],
+        help="The accumulator thresholds to try.")
+    parser.add_argument("--calib", nargs="?", type=str, default=None,
+        help="An optional way to pass custom calibration parameters.")
+    parser.add_argument("--workers", nargs="?", type=int, default=None,
+        help="The number of settings to score at once. Defaults to one per core.")
+    parser.add_argument("--report", nargs="?", type=str, default=None,
+        help="Write the results as JSON to this file (\"-\" for stdout).")
+    args = parser.parse_args()
+    if any(blurSize <= 0 or blurSize % 2 == 0 for blurSize in args.blurSize):
+        parser.error("--blurSize values must be positive and odd")
+
+    results = sweep(args.infile, blurSizes=args.blurSize, minDists=args.minDist,
+        param1s=args.param1, param2s=args.param2, calib=args.calib, workers=args.workers)
+
+    if args.report == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    if args.report is not None:
+        with open(args.report, 'w') as reportFile:
+            json.dump(results, reportFile, indent=2)
+
+    print("blur\tminDist\tparam1\tparam2\tmissed\tmean\terror")
+    for result in results:
+        print("%d\t%s\t%g\t%g\t%d/%d\t%s\t%s" % (result["blurSize"], result["minDist"],
+            result["param1"], result["param2"], result["missedFrames"], result["frames"],
+            "%.1f" % result["mean"] if "mean" in result else "-",
+            "%.1f" % result["meanError"] if "meanError" in result else "-"))
+
+if __name__ == "__main__":
+    main()
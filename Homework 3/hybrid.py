@@ -1,41 +1,622 @@
 """
 Makes a hybrid of two provided images.
 """
+import os
+import time
+import shlex
+import argparse
+import itertools
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
 import cv2
 import numpy as np
-import argparse
+
+import playback
 
 KERNEL_SIZE = 31
 KERNEL_SIGMA = 5
 DEFAULT_EXT = '.png'
+ARRAY_EXT = '.npy'
+TILE_SIZE = 1024
+VIDEO_EXTS = ('.mp4', '.avi', '.mov')
+WINDOW_NAME = "Hybrid"
+MODES = ("auto", "spatial", "fft")
+# The time of one unit of n log2(n) float32 cv2.dft work, in separable multiply-adds.
+# Measured, the FFT overtakes the separable filters at about 60 taps from 0.4 to 8 megapixels
+FFT_COST_RATIO = 3.5
+# cv2.sepFilter2D beats cv2.filter2D, which filters large kernels through its own DFT,
+# while the taps times the square root of the pixel count stays under this. Measured, the
+# crossover is about 115 taps at 2 megapixels and 60 taps at 8 megapixels
+SEPARABLE_LIMIT = 165000
 
-def normalizeImage(image, maxRange=255., minRange=0.):
+def normalizeImage(image, maxRange=255., minRange=0., out=None):
     """Scales an image to fit in the range of [0, 1].
 
     Args:
         image (cv2.Mat): The image to modify.
         maxRange (float, optional): The high range of values from the image. Defaults to 255.
         minRange (float, optional): The low range of values from the image. Defaults to 0.
+        out (np.ndarray, optional): A float32 buffer of the same shape to write into.
+            Defaults to None.
 
     Returns:
         cv2.Mat: The image normalized to the range of [0, 1].
     """
     spread = maxRange - minRange
-    return (np.float32(image) - minRange) / spread
+    if out is None:
+        return (np.float32(image) - minRange) / spread
 
-def denornalizeImage(image, maxRange=255., minRange=0.):
+    np.subtract(image, np.float32(minRange), out=out)
+    out /= np.float32(spread)
+    return out
+
+def denornalizeImage(image, maxRange=255., minRange=0., out=None):
     """Scales an image back up to a usable range.
 
     Args:
         image (cv2.Mat): The image to modify.
         maxRange (float, optional): The high range of values from the original image. Defaults to 255.
         minRange (float, optional): The low range of values from the original image. Defaults to 0.
+        out (np.ndarray, optional): A buffer of the same shape to write into, which may
+            be the image itself. Defaults to None.
 
     Returns:
         cv2.Mat: The image re-scaled to the range of [minRange, maxRange].
     """
     spread = maxRange - minRange
-    return (image * spread) + minRange
+    if out is None:
+        return (image * spread) + minRange
+
+    np.multiply(image, np.float32(spread), out=out)
+    out += np.float32(minRange)
+    return out
+
+def cropToMatch(featureImage, colorImage):
+    """Crops two images down to the size they share.
+
+    Args:
+        featureImage (cv2.Mat): The first image.
+        colorImage (cv2.Mat): The second image.
+
+    Returns:
+        featureImage, colorImage: The cropped images.
+    """
+    height = min(featureImage.shape[0], colorImage.shape[0])
+    width = min(featureImage.shape[1], colorImage.shape[1])
+    return featureImage[:height, :width], colorImage[:height, :width]
+
+def useSeparable(shape, kernelSize):
+    """Estimates whether two 1D passes beat filtering with the full 2D kernel. The 1D
+    passes cost kernelSize per pixel and slow down as the image outgrows the caches, while
+    cv2.filter2D switches to the DFT for large kernels.
+
+    Args:
+        shape (tuple): The shape of the image.
+        kernelSize (int): The size of the kernel.
+
+    Returns:
+        bool: True when the separable filter is expected to be faster.
+    """
+    return kernelSize * np.sqrt(shape[0] * shape[1]) <= SEPARABLE_LIMIT
+
+def lowpassImage(image, kernel):
+    """Blurs an image with a separable kernel. Small kernels take one row pass and one
+    column pass, larger ones the full 2D kernel, which cv2.filter2D applies through the DFT.
+
+    Args:
+        image (cv2.Mat): The image to filter.
+        kernel (np.ndarray): The 1D kernel, as from cv2.getGaussianKernel.
+
+    Returns:
+        cv2.Mat: The low frequencies of the image.
+    """
+    if useSeparable(image.shape, len(kernel)):
+        return cv2.sepFilter2D(image, -1, kernel, kernel)
+    return cv2.filter2D(image, -1, kernel * kernel.T)
+
+def highpassImage(image, kernel):
+    """Removes the low frequencies from an image. This is the same as filtering with
+    the identity kernel minus the low-pass kernel.
+
+    Args:
+        image (cv2.Mat): The image to filter.
+        kernel (np.ndarray): The 1D low-pass kernel, as from cv2.getGaussianKernel.
+
+    Returns:
+        cv2.Mat: The high frequencies of the image.
+    """
+    return image - lowpassImage(image, kernel)
+
+@lru_cache(maxsize=None)
+def gaussianKernel(kernelSize, sigma):
+    """Builds the 1D gaussian kernel once per (kernelSize, sigma).
+
+    Args:
+        kernelSize (int): The size of the gaussian kernel.
+        sigma (float): The sigma of the gaussian kernel.
+
+    Returns:
+        np.ndarray: The read only (kernelSize, 1) kernel.
+    """
+    kernel = cv2.getGaussianKernel(kernelSize, sigma)
+    kernel.setflags(write=False)
+    return kernel
+
+def paddedShape(shape, kernelSize):
+    """Gets the fast transform size of an image padded by the kernel radius on each side.
+
+    Args:
+        shape (tuple): The shape of the image.
+        kernelSize (int): The size of the kernel.
+
+    Returns:
+        tuple: The padded (height, width).
+    """
+    radius = kernelSize // 2
+    return (cv2.getOptimalDFTSize(shape[0] + 2 * radius),
+        cv2.getOptimalDFTSize(shape[1] + 2 * radius))
+
+@lru_cache(maxsize=8)
+def gaussianSpectrum(shape, kernelSize, sigma):
+    """Gets the frequency response of a gaussian kernel centered on the origin of a padded
+    image, built once per (shape, kernelSize, sigma).
+
+    Args:
+        shape (tuple): The padded (height, width).
+        kernelSize (int): The size of the gaussian kernel.
+        sigma (float): The sigma of the gaussian kernel.
+
+    Returns:
+        np.ndarray: The read only float32 response, packed like the real output of cv2.dft.
+    """
+    kernel = gaussianKernel(kernelSize, sigma)
+
+    # The filters correlate around the anchor, so the kernel is flipped for the transform
+    offsets = kernelSize // 2 - np.arange(kernelSize)
+    padded = np.zeros(shape, dtype=np.float32)
+    padded[np.ix_(offsets % shape[0], offsets % shape[1])] = kernel * kernel.T
+    spectrum = cv2.dft(padded)
+    spectrum.setflags(write=False)
+
+    return spectrum
+
+def spatialHybrid(featureNorm, colorNorm, kernelSize, sigma):
+    """Builds a hybrid of two normalized images of the same size with spatial filters.
+
+    Args:
+        featureNorm (cv2.Mat): The normalized image to take the high frequencies from.
+        colorNorm (cv2.Mat): The normalized image to take the low frequencies from.
+        kernelSize (int): The size of the gaussian kernel.
+        sigma (float): The sigma of the gaussian kernel.
+
+    Returns:
+        cv2.Mat: The normalized hybrid image.
+    """
+    # Steps 2 and 3, the 2D gaussian is the outer product of this kernel with itself
+    kernel = gaussianKernel(kernelSize, sigma)
+
+    # Step 4
+    lowImage = lowpassImage(colorNorm, kernel)
+    highImage = highpassImage(featureNorm, kernel)
+
+    return lowImage + highImage
+
+def fftHybrid(featureNorm, colorNorm, kernelSize, sigma):
+    """Builds a hybrid of two normalized images of the same size in the frequency domain.
+    Each channel of each image is transformed once, and the low-pass L and high-pass 1 - L
+    responses are applied as spectral multiplies before a single inverse transform. The
+    images are reflected at the edges like the spatial filters, so the results match.
+
+    Args:
+        featureNorm (cv2.Mat): The normalized image to take the high frequencies from.
+        colorNorm (cv2.Mat): The normalized image to take the low frequencies from.
+        kernelSize (int): The size of the gaussian kernel.
+        sigma (float): The sigma of the gaussian kernel.
+
+    Returns:
+        cv2.Mat: The normalized hybrid image.
+    """
+    height, width = featureNorm.shape[:2]
+    radius = kernelSize // 2
+    shape = paddedShape(featureNorm.shape, kernelSize)
+
+    def pad(image):
+        return cv2.copyMakeBorder(image, radius, shape[0] - height - radius, radius,
+            shape[1] - width - radius, cv2.BORDER_REFLECT_101)
+
+    lowpass = gaussianSpectrum(shape, kernelSize, sigma)
+
+    # L * color + (1 - L) * feature, one channel at a time in float32
+    channels = []
+    for feature, color in zip(cv2.split(featureNorm), cv2.split(colorNorm)):
+        featureSpectrum = cv2.dft(pad(feature))
+        hybridSpectrum = cv2.dft(pad(color))
+        hybridSpectrum -= featureSpectrum
+        hybridSpectrum = cv2.mulSpectrums(hybridSpectrum, lowpass, 0)
+        hybridSpectrum += featureSpectrum
+
+        hybrid = cv2.idft(hybridSpectrum, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+        channels.append(hybrid[radius:radius + height, radius:radius + width])
+
+    return cv2.merge(channels) if featureNorm.ndim == 3 else channels[0]
+
+def useFFT(shape, kernelSize):
+    """Estimates whether frequency domain filtering beats spatial filtering. The two
+    separable low-pass filters cost 4 * kernelSize multiply-adds per pixel, against three
+    transforms of the padded image. Kernels too large for the separable filters are
+    always faster in the frequency domain, as cv2.filter2D would take two DFT passes.
+
+    Args:
+        shape (tuple): The shape of the images.
+        kernelSize (int): The size of the gaussian kernel.
+
+    Returns:
+        bool: True when the FFT is expected to be faster.
+    """
+    if not useSeparable(shape, kernelSize): return True
+
+    height, width = paddedShape(shape, kernelSize)
+    spatialCost = 4 * kernelSize * shape[0] * shape[1]
+    fftCost = FFT_COST_RATIO * 3 * height * width * np.log2(height * width)
+    return fftCost < spatialCost
+
+def filterHybrid(featureNorm, colorNorm, kernelSize, sigma, mode):
+    """Builds a hybrid of two normalized images of the same size.
+
+    Args:
+        featureNorm (cv2.Mat): The normalized image to take the high frequencies from.
+        colorNorm (cv2.Mat): The normalized image to take the low frequencies from.
+        kernelSize (int): The size of the gaussian kernel.
+        sigma (float): The sigma of the gaussian kernel.
+        mode (str): One of MODES.
+
+    Returns:
+        cv2.Mat: The normalized hybrid image.
+    """
+    if mode == "fft" or (mode == "auto" and useFFT(featureNorm.shape, kernelSize)):
+        return fftHybrid(featureNorm, colorNorm, kernelSize, sigma)
+    return spatialHybrid(featureNorm, colorNorm, kernelSize, sigma)
+
+def makeHybrid(featureImage, colorImage, kernelSize=KERNEL_SIZE, sigma=KERNEL_SIGMA,
+    mode="auto"):
+    """Merges the high frequencies of one image with the low frequencies of another.
+
+    Args:
+        featureImage (cv2.Mat): The image to take the high frequencies from.
+        colorImage (cv2.Mat): The image to take the low frequencies from.
+        kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+        sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+        mode (str, optional): Filter with "spatial" separable filters, in the "fft"
+            frequency domain, or pick the cheaper with "auto". Defaults to "auto".
+
+    Returns:
+        cv2.Mat: The float hybrid image in the range of the inputs.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown hybrid mode \"" + str(mode) + "\".")
+
+    # Make the images the same size
+    featureImage, colorImage = cropToMatch(featureImage, colorImage)
+
+    # Step 1
+    featureNorm = normalizeImage(featureImage)
+    colorNorm = normalizeImage(colorImage)
+
+    # Steps 2 to 4
+    hybrid = filterHybrid(featureNorm, colorNorm, kernelSize, sigma, mode)
+
+    # Step 5
+    return denornalizeImage(hybrid)
+
+def tiledHybrid(featureImage, colorImage, output, kernelSize=KERNEL_SIZE, sigma=KERNEL_SIGMA,
+    mode="auto", tileSize=TILE_SIZE):
+    """Merges two images tile by tile, so only one tile and its halo are held as floats
+    at a time. Each tile is read with a halo of the kernel radius, so the filters
+    only reflect at the true image edges and the result matches makeHybrid.
+
+    Args:
+        featureImage (np.ndarray): The image to take the high frequencies from, possibly
+            memory-mapped.
+        colorImage (np.ndarray): The image to take the low frequencies from, possibly
+            memory-mapped.
+        output (np.ndarray): The uint8 array to write the hybrid into, possibly
+            memory-mapped, the size of the cropped images.
+        kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+        sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+        mode (str, optional): The filtering mode of each tile, as in makeHybrid.
+            Defaults to "auto".
+        tileSize (int, optional): The height and width of each tile. Defaults to TILE_SIZE.
+
+    Returns:
+        np.ndarray: The output array.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown hybrid mode \"" + str(mode) + "\".")
+
+    featureImage, colorImage = cropToMatch(featureImage, colorImage)
+    height, width = featureImage.shape[:2]
+    radius = kernelSize // 2
+    for top in range(0, height, tileSize):
+        for left in range(0, width, tileSize):
+            bottom = min(height, top + tileSize)
+            right = min(width, left + tileSize)
+
+            # Read the tile with its halo, clipped to the image
+            haloTop = max(0, top - radius)
+            haloLeft = max(0, left - radius)
+            window = (slice(haloTop, min(height, bottom + radius)),
+                slice(haloLeft, min(width, right + radius)))
+            hybrid = filterHybrid(normalizeImage(featureImage[window]),
+                normalizeImage(colorImage[window]), kernelSize, sigma, mode)
+
+            tile = denornalizeImage(hybrid[top - haloTop:bottom - haloTop,
+                left - haloLeft:right - haloLeft])
+            output[top:bottom, left:right] = np.clip(np.rint(tile), 0, 255)
+
+    return output
+
+def loadImage(path):
+    """Opens an image, memory-mapping it when it is stored as a .npy array.
+
+    Args:
+        path (str): The image or .npy file.
+
+    Returns:
+        np.ndarray: The image, or None when it could not be opened.
+    """
+    if path.endswith(ARRAY_EXT):
+        return np.load(path, mmap_mode='r')
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+class HybridStream:
+    """Merges a stream of frame pairs into hybrids, building the kernel once and reusing
+    every buffer across frames, so no float arrays are allocated per frame. The
+    separable filters are used since they write into the buffers in place.
+    """
+
+    def __init__(self, kernelSize=KERNEL_SIZE, sigma=KERNEL_SIGMA, outputs=1):
+        """
+        Args:
+            kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+            sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+            outputs (int, optional): The number of output buffers to cycle through, so a
+                hybrid stays valid while the next ones are merged. Defaults to 1.
+        """
+        self.kernel = gaussianKernel(kernelSize, sigma)
+        self.outputs = outputs
+        self.shape = None
+
+    def allocate(self, shape):
+        """Allocates the buffers for a frame shape.
+
+        Args:
+            shape (tuple): The shape of the cropped frames.
+        """
+        self.shape = shape
+        self.frameNorm = np.empty(shape, dtype=np.float32)
+        self.lowImage = np.empty(shape, dtype=np.float32)
+        self.highImage = np.empty(shape, dtype=np.float32)
+        self.hybrid = np.empty(shape, dtype=np.float32)
+        self.outputImages = [np.empty(shape, dtype=np.uint8) for _ in range(self.outputs)]
+        self.outputIndex = 0
+
+    def merge(self, featureFrame=None, colorFrame=None):
+        """Merges the next pair of frames. A still image only needs to be given once, as
+        the filtered half of the last frame given is kept.
+
+        Args:
+            featureFrame (cv2.Mat, optional): The next frame to take the high frequencies
+                from, or None to reuse the last. Defaults to None.
+            colorFrame (cv2.Mat, optional): The next frame to take the low frequencies
+                from, or None to reuse the last. Defaults to None.
+
+        Returns:
+            np.ndarray: The uint8 hybrid, overwritten after the next `outputs` merges.
+        """
+        if self.shape is None:
+            if featureFrame is None or colorFrame is None:
+                raise ValueError("The first merge needs both frames.")
+            self.allocate(cropToMatch(featureFrame, colorFrame)[0].shape)
+        height, width = self.shape[:2]
+
+        # Steps 1 to 4, into the kept low and high frequency buffers
+        if colorFrame is not None:
+            normalizeImage(colorFrame[:height, :width], out=self.frameNorm)
+            cv2.sepFilter2D(self.frameNorm, -1, self.kernel, self.kernel, dst=self.lowImage)
+        if featureFrame is not None:
+            normalizeImage(featureFrame[:height, :width], out=self.frameNorm)
+            cv2.sepFilter2D(self.frameNorm, -1, self.kernel, self.kernel, dst=self.highImage)
+            np.subtract(self.frameNorm, self.highImage, out=self.highImage)
+
+        # Step 5
+        np.add(self.lowImage, self.highImage, out=self.hybrid)
+        denornalizeImage(self.hybrid, out=self.hybrid)
+        np.rint(self.hybrid, out=self.hybrid)
+        np.clip(self.hybrid, 0, 255, out=self.hybrid)
+
+        output = self.outputImages[self.outputIndex]
+        self.outputIndex = (self.outputIndex + 1) % self.outputs
+        np.copyto(output, self.hybrid, casting='unsafe')
+        return output
+
+def openStream(path):
+    """Opens a video, or a still image that is given once and then as None.
+
+    Args:
+        path (str): The video or image file.
+
+    Raises:
+        IOError: When the file could not be opened.
+
+    Returns:
+        iterator: The frames, along with whether the file is a still image.
+    """
+    image = loadImage(path)
+    if image is not None:
+        return itertools.chain([image], itertools.repeat(None)), True
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError("Error opening \"" + path + "\".")
+    return playback.readVideo(capture), False
+
+def streamHybrid(featureFile, colorFile, output=None, kernelSize=KERNEL_SIZE,
+    sigma=KERNEL_SIGMA, fps=30):
+    """Plays the hybrid of two videos, or of a video and a still image, optionally
+    writing it to a video file.
+
+    Args:
+        featureFile (str): The video or image to read the features from.
+        colorFile (str): The video or image to read the colors from.
+        output (str, optional): The video file to write. Defaults to None.
+        kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+        sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+        fps (float, optional): The frame rate to play and write at. Defaults to 30.
+
+    Raises:
+        IOError: When either file could not be opened.
+        ValueError: When neither file is a video.
+
+    Returns:
+        playback.PlaybackStats: The playback counts.
+    """
+    features, featureStill = openStream(featureFile)
+    colors, colorStill = openStream(colorFile)
+    if featureStill and colorStill:
+        raise ValueError("At least one of the inputs must be a video.")
+
+    # Keep enough outputs for every frame queued for display
+    stream = HybridStream(kernelSize=kernelSize, sigma=sigma, outputs=playback.QUEUE_SIZE + 2)
+    writer = None
+
+    def mergeFrames(frames):
+        nonlocal writer
+        hybrid = stream.merge(*frames)
+        if output is not None:
+            if writer is None:
+                writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                    (hybrid.shape[1], hybrid.shape[0]))
+            writer.write(hybrid)
+        return hybrid
+
+    try:
+        # Every frame has to reach the writer, so only plain playback skips late frames
+        stats = playback.play(zip(features, colors), mergeFrames, WINDOW_NAME, fps=fps,
+            dropLate=output is None)
+    finally:
+        if writer is not None: writer.release()
+
+    return stats
+
+def writeHybrid(featureFile, colorFile, output, kernelSize=KERNEL_SIZE, sigma=KERNEL_SIGMA,
+    mode="auto", tileSize=None):
+    """Reads two images, merges them, and writes the hybrid.
+
+    Args:
+        featureFile (str): The file to read the features from.
+        colorFile (str): The file to read the colors from.
+        output (str): The file to write, given DEFAULT_EXT unless it ends in DEFAULT_EXT
+            or ARRAY_EXT.
+        kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+        sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+        mode (str, optional): The filtering mode, as in makeHybrid. Defaults to "auto".
+        tileSize (int, optional): Build the hybrid in tiles of this size with tiledHybrid.
+            Defaults to None.
+
+    Raises:
+        IOError: When either image could not be opened.
+
+    Returns:
+        bool: True if the hybrid was written.
+    """
+    featureImage = loadImage(featureFile)
+    if featureImage is None:
+        raise IOError("Error opening feature image \"" + featureFile + "\".")
+    colorImage = loadImage(colorFile)
+    if colorImage is None:
+        raise IOError("Error opening color image \"" + colorFile + "\".")
+
+    outfileName = output
+    if outfileName[-4:] != DEFAULT_EXT and outfileName[-4:] != ARRAY_EXT:
+        outfileName += DEFAULT_EXT
+
+    if tileSize is None:
+        outputImage = makeHybrid(featureImage, colorImage, kernelSize=kernelSize,
+            sigma=sigma, mode=mode)
+        if outfileName.endswith(ARRAY_EXT):
+            np.save(outfileName, np.clip(np.rint(outputImage), 0, 255).astype(np.uint8))
+            return True
+        return cv2.imwrite(outfileName, outputImage)
+
+    # Write each tile straight to the output
+    featureImage, colorImage = cropToMatch(featureImage, colorImage)
+    if outfileName.endswith(ARRAY_EXT):
+        outputImage = np.lib.format.open_memmap(outfileName, mode='w+', dtype=np.uint8,
+            shape=featureImage.shape)
+    else:
+        outputImage = np.empty(featureImage.shape, dtype=np.uint8)
+    tiledHybrid(featureImage, colorImage, outputImage, kernelSize=kernelSize,
+        sigma=sigma, mode=mode, tileSize=tileSize)
+
+    if outfileName.endswith(ARRAY_EXT):
+        outputImage.flush()
+        return True
+    return cv2.imwrite(outfileName, outputImage)
+
+def readManifest(path):
+    """Reads the image pairs to merge from a manifest. Each line holds a feature file,
+    a color file, and an output file, quoted like a shell command line when they hold
+    spaces. Blank lines and lines starting with # are skipped, and relative paths are
+    relative to the manifest.
+
+    Args:
+        path (str): The manifest file.
+
+    Returns:
+        list: The (featureFile, colorFile, output) of each pair.
+    """
+    baseDir = os.path.dirname(os.path.realpath(path))
+    pairs = []
+    with open(path, 'r') as manifest:
+        for lineNumber, line in enumerate(manifest, 1):
+            fields = shlex.split(line, comments=True)
+            if len(fields) == 0: continue
+            if len(fields) != 3:
+                raise ValueError("Expected a feature, color, and output file on line " +
+                    str(lineNumber) + " of \"" + path + "\".")
+            pairs.append(tuple(os.path.join(baseDir, field) for field in fields))
+
+    return pairs
+
+def batchHybrid(pairs, kernelSize=KERNEL_SIZE, sigma=KERNEL_SIGMA, mode="auto", tileSize=None,
+    workers=None):
+    """Merges many image pairs across worker processes. Each worker builds every kernel
+    and kernel spectrum once, then reuses it for each pair with the same settings.
+
+    Args:
+        pairs (list): The (featureFile, colorFile, output) of each pair.
+        kernelSize (int, optional): The size of the gaussian kernel. Defaults to KERNEL_SIZE.
+        sigma (float, optional): The sigma of the gaussian kernel. Defaults to KERNEL_SIGMA.
+        mode (str, optional): The filtering mode, as in makeHybrid. Defaults to "auto".
+        tileSize (int, optional): Build each hybrid in tiles of this size. Defaults to None.
+        workers (int, optional): The number of worker processes. Defaults to one per core.
+
+    Returns:
+        list: The error of each pair, None for the pairs that were written.
+    """
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(writeHybrid, featureFile, colorFile, output,
+            kernelSize=kernelSize, sigma=sigma, mode=mode, tileSize=tileSize)
+            for featureFile, colorFile, output in pairs]
+        for future in futures:
+            try:
+                errors.append(None if future.result() else IOError("Error writing the hybrid."))
+            except (IOError, ValueError, cv2.error) as error:
+                errors.append(error)
+
+    return errors
 
 def main():
     """
@@ -43,62 +624,74 @@ def main():
     """
     parser = argparse.ArgumentParser(description="Create a hybrid of images " +
         "based off the features found in them.")
-    parser.add_argument("featureFile", nargs=1, type=str, default=None, 
+    parser.add_argument("featureFile", nargs="?", type=str, default=None, 
         help="The file to read the features, viewable in a full size depiction " + 
         "of the image, to merge into the hybrid image.")
-    parser.add_argument("colorFile", nargs=1, type=str, default=None, 
+    parser.add_argument("colorFile", nargs="?", type=str, default=None, 
         help="The file to read the colors out of, viewable in a preview like " + 
         "depiction, to merge into the hybrid image.")
     parser.add_argument("output", nargs="?", type=str, default="hybrid.png",
         help="The hybrid image output.")
+    parser.add_argument("--kernelSize", nargs="?", type=int, default=KERNEL_SIZE,
+        help="The size of the gaussian kernel, odd.")
+    parser.add_argument("--sigma", nargs="?", type=float, default=KERNEL_SIGMA,
+        help="The sigma of the gaussian kernel.")
+    parser.add_argument("--mode", nargs="?", type=str, default="auto", choices=MODES,
+        help="Filter spatially, in the frequency domain, or whichever is cheaper.")
+    parser.add_argument("--tileSize", nargs="?", type=int, default=None,
+        help="Build the hybrid in tiles of this size to bound memory. Inputs and an " +
+        "output ending in " + ARRAY_EXT + " are memory-mapped.")
+    parser.add_argument("--batch", nargs="?", type=str, default=None,
+        help="A manifest of \"featureFile colorFile output\" lines to merge instead.")
+    parser.add_argument("--workers", nargs="?", type=int, default=None,
+        help="The number of pairs to merge at once in batch mode. Defaults to one per core.")
+    parser.add_argument("--video", action="store_true",
+        help="Play the hybrid of two videos, or of a video and an image, writing it " +
+        "when the output ends in one of " + ", ".join(VIDEO_EXTS) + ".")
+    parser.add_argument("--fps", nargs="?", type=float, default=30,
+        help="The FPS to play and write the hybrid video at.")
     args = parser.parse_args()
 
-    # Open the images
-    featureImage = cv2.imread(args.featureFile[0], cv2.IMREAD_COLOR)
-    colorImage = cv2.imread(args.colorFile[0], cv2.IMREAD_COLOR)
-    if featureImage is None:
-        print('Error opening feature image.')
-        parser.print_usage()
-        return -1
-    if colorImage is None:
-        print('Error opening color image.')
-        parser.print_usage()
-        return -1
-
-    # Make the images the same size
-    if colorImage.shape[0] > featureImage.shape[0]:
-        colorImage = colorImage[:featureImage.shape[0], :, :]
-    else:
-        featureImage = featureImage[:colorImage.shape[0], :, :]
-    if colorImage.shape[1] > featureImage.shape[1]:
-        colorImage = colorImage[:, :featureImage.shape[1], :]
-    else:
-        featureImage = featureImage[:, :colorImage.shape[1], :]
-
-    # Step 1
-    featureNorm = normalizeImage(featureImage)
-    colorNorm = normalizeImage(colorImage)
+    # Merge every pair in the manifest
+    if args.batch is not None:
+        pairs = readManifest(args.batch)
+        startTime = time.time()
+        errors = batchHybrid(pairs, kernelSize=args.kernelSize, sigma=args.sigma,
+            mode=args.mode, tileSize=args.tileSize, workers=args.workers)
+        elapsed = time.time() - startTime
 
-    # Step 2
-    kernel = cv2.getGaussianKernel(KERNEL_SIZE, KERNEL_SIGMA)
-    lowpassKernel = kernel * kernel.transpose()
+        for (_, _, output), error in zip(pairs, errors):
+            if error is not None: print(output + ": " + str(error))
+        written = errors.count(None)
+        print("Wrote %d of %d hybrids in %.2fs (%.2f pairs/s)." % (written, len(pairs),
+            elapsed, written / elapsed if elapsed > 0 else 0.))
+        return written == len(pairs)
 
-    # Step 3
-    highpassKernel = np.zeros_like(kernel, dtype=np.float32)
-    highpassKernel[int(KERNEL_SIZE/2)] = 1
-    highpassKernel = (highpassKernel * highpassKernel.transpose()) - lowpassKernel
+    if args.featureFile is None or args.colorFile is None:
+        parser.print_usage()
+        return -1
 
-    # Step 4
-    lowImage = cv2.filter2D(colorNorm, -1, lowpassKernel) * 255
-    highImage = cv2.filter2D(featureNorm, -1, highpassKernel) * 255
+    if args.video:
+        output = args.output if args.output.lower().endswith(VIDEO_EXTS) else None
+        try:
+            print(streamHybrid(args.featureFile, args.colorFile, output=output,
+                kernelSize=args.kernelSize, sigma=args.sigma, fps=args.fps))
+        except (IOError, ValueError) as error:
+            print(error)
+            parser.print_usage()
+            return -1
+        cv2.waitKey(0)
+        cv2.destroyWindow(WINDOW_NAME)
+        return True
 
-    # Step 5
-    outputImage = lowImage + highImage
-    outfileName = args.output
-    if outfileName[-4:] != DEFAULT_EXT:
-        outfileName += DEFAULT_EXT
-    
-    return cv2.imwrite(outfileName, outputImage)
+    try:
+        return writeHybrid(args.featureFile, args.colorFile, args.output,
+            kernelSize=args.kernelSize, sigma=args.sigma, mode=args.mode,
+            tileSize=args.tileSize)
+    except IOError as error:
+        print(error)
+        parser.print_usage()
+        return -1
 
 if __name__ == "__main__":
     main()
@@ -5,8 +5,9 @@ Detects matches from a target image in a video, then draws them.
 import cv2
 import numpy as np
 import argparse
-import time
-from time import sleep
+
+import siftcache
+import playback
 
 WINDOW_NAME = "Bonus - AR Overlay"
 RATIO_THRESHOLD = 0.7
@@ -28,6 +29,8 @@ def main():
         help="The frames per second to display the video at.")
     parser.add_argument("--ratioThresh", nargs=1, type=float, default=[RATIO_THRESHOLD], required=False,
         help="The threshold to use for the ratio test during feature matching.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the target features instead of loading cached ones.")
     args = parser.parse_args()
 
     # Logging
@@ -44,19 +47,19 @@ def main():
         print("Cound not open image at \"" + args.overlayImage[0] + "\"")
     overlayMaskBase = np.ones_like(overlayImage)
     sift = cv2.SIFT_create()
-    targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    if args.noCache:
+        targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    else:
+        targetPoints, targetDescriptions = siftcache.cachedDetectAndCompute(sift, targetImage)
 
     # Create the matching system and match features for each frame
     matcher = cv2.BFMatcher()
     capture = cv2.VideoCapture(args.inputVideo[0])
-    videoImg = None
     if not capture.isOpened():
         print("Could not open the video at \"" + args.inputVideo[0] + "\"")
         exit()
-    while capture.isOpened():
-        startTime = time.time()
-        ret, videoImg = capture.read()
-        if not ret: break
+    def processFrame(videoImg):
+        nonlocal inlierCount, matchCount
         keypoints, descriptions = sift.detectAndCompute(videoImg, None)
         
         # Run the matching system
@@ -87,15 +90,12 @@ def main():
             overlayMask = cv2.warpPerspective(overlayMaskBase, targetObject, dataShape)
 
             videoImg = (videoImg*(1-overlayMask)) + (overlayImg*overlayMask)
-        
-        cv2.imshow(WINDOW_NAME, videoImg)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: 
-            sleepTime = (1 / args.fps[0]) - (time.time() - startTime)
-            if sleepTime > 0: sleep(sleepTime)
-    capture.release()
-
-    cv2.imshow(WINDOW_NAME, videoImg)
+
+        return videoImg
+
+    # Display
+    print(playback.play(playback.readVideo(capture), processFrame, WINDOW_NAME, fps=args.fps[0],
+        dropLate=True))
     cv2.waitKey(0)
     cv2.destroyWindow(WINDOW_NAME)
 
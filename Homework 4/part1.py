@@ -3,8 +3,9 @@ Simply runs and draws SIFT computations.
 """
 import cv2
 import argparse
-import time
-from time import sleep
+
+import siftcache
+import playback
 
 WINDOW_NAME = "Part 1 - SIFT Example"
 
@@ -17,8 +18,10 @@ def main():
         help="The image to run sift on.")
     parser.add_argument("inputVideo", nargs=1, type=str, default=None,
         help="The video to search through.")
-    parser.add_argument("--fps", nargs=1, type=int, default=30, required=False,
+    parser.add_argument("--fps", nargs=1, type=int, default=[30], required=False,
         help="The frames per second to display the video at.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the target features instead of loading cached ones.")
     args = parser.parse_args()
 
     # Load the target image, detect features
@@ -27,7 +30,10 @@ def main():
         print("Could not open image at \"" + args.inputImage[0] + "\"")
         exit()
     sift = cv2.SIFT_create()
-    keypoints, _ = sift.detectAndCompute(targetImage, None)
+    if args.noCache:
+        keypoints, _ = sift.detectAndCompute(targetImage, None)
+    else:
+        keypoints, _ = siftcache.cachedDetectAndCompute(sift, targetImage)
     writtenImage = None
     writtenImage = cv2.drawKeypoints(targetImage, keypoints, writtenImage,
         flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
@@ -41,24 +47,14 @@ def main():
     if not capture.isOpened():
         print("Could not open the video at \"" + args.inputVideo[0] + "\"")
         exit()
-    while capture.isOpened():
-        startTime = time.time()
-        ret, videoImg = capture.read()
-        if not ret: break
-
+    def processFrame(videoImg):
         keypoints, _ = sift.detectAndCompute(videoImg, None)
-        writtenImage = cv2.drawKeypoints(videoImg, keypoints, writtenImage,
+        return cv2.drawKeypoints(videoImg, keypoints, None,
             flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
 
-        # Display
-        cv2.imshow(WINDOW_NAME, writtenImage)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: 
-            sleepTime = (1 / args.fps) - (time.time() - startTime)
-            if sleepTime > 0: sleep(sleepTime)
-    capture.release()
-
-    cv2.imshow(WINDOW_NAME, writtenImage)
+    # Display
+    print(playback.play(playback.readVideo(capture), processFrame, WINDOW_NAME, fps=args.fps[0],
+        dropLate=True))
     cv2.waitKey(0)
     cv2.destroyWindow(WINDOW_NAME)
 
@@ -3,8 +3,9 @@ Detects matches from a target image in a video, then draws them.
 """
 import cv2
 import argparse
-import time
-from time import sleep
+
+import siftcache
+import playback
 
 WINDOW_NAME = "Part 2 - SIFT Matching"
 RATIO_THRESHOLD = 0.7
@@ -22,6 +23,8 @@ def main():
         help="The frames per second to display the video at.")
     parser.add_argument("--ratioThresh", nargs=1, type=float, default=[RATIO_THRESHOLD], required=False,
         help="The threshold to use for the ratio test during feature matching.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the target features instead of loading cached ones.")
     args = parser.parse_args()
 
     # Load the target image, detect features
@@ -30,19 +33,18 @@ def main():
         print("Could not open image at \"" + args.targetImage[0] + "\"")
         exit()
     sift = cv2.SIFT_create()
-    targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    if args.noCache:
+        targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    else:
+        targetPoints, targetDescriptions = siftcache.cachedDetectAndCompute(sift, targetImage)
 
     # Create the matching system and match features for each frame
     matcher = cv2.BFMatcher()
-    writtenImage = None
     capture = cv2.VideoCapture(args.inputVideo[0])
     if not capture.isOpened():
         print("Could not open the video at \"" + args.inputVideo[0] + "\"")
         exit()
-    while capture.isOpened():
-        startTime = time.time()
-        ret, videoImg = capture.read()
-        if not ret: break
+    def processFrame(videoImg):
         keypoints, descriptions = sift.detectAndCompute(videoImg, None)
         
         # Run the matching system
@@ -54,17 +56,13 @@ def main():
             if match.distance < args.ratioThresh[0]*other.distance:
                 good.append([match])
 
-        # Draw, display
-        writtenImage = cv2.drawMatchesKnn(targetImage, targetPoints, videoImg, keypoints,
-            good, writtenImage, singlePointColor=(255, 0, 255), flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-        cv2.imshow(WINDOW_NAME, writtenImage)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: 
-            sleepTime = (1 / args.fps[0]) - (time.time() - startTime)
-            if sleepTime > 0: sleep(sleepTime)
-    capture.release()
+        # Draw
+        return cv2.drawMatchesKnn(targetImage, targetPoints, videoImg, keypoints,
+            good, None, singlePointColor=(255, 0, 255), flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
 
-    cv2.imshow(WINDOW_NAME, writtenImage)
+    # Display
+    print(playback.play(playback.readVideo(capture), processFrame, WINDOW_NAME, fps=args.fps[0],
+        dropLate=True))
     cv2.waitKey(0)
     cv2.destroyWindow(WINDOW_NAME)
 
@@ -5,8 +5,9 @@ around the target.
 import cv2
 import numpy as np
 import argparse
-import time
-from time import sleep
+
+import siftcache
+import playback
 
 WINDOW_NAME = "Part 3 - SIFT Object Detection"
 RATIO_THRESHOLD = 0.7
@@ -25,6 +26,8 @@ def main():
         help="The frames per second to display the video at.")
     parser.add_argument("--ratioThresh", nargs=1, type=float, default=[RATIO_THRESHOLD], required=False,
         help="The threshold to use for the ratio test during feature matching.")
+    parser.add_argument("--noCache", action="store_true",
+        help="Always detect the target features instead of loading cached ones.")
     args = parser.parse_args()
 
     # Logging
@@ -40,19 +43,19 @@ def main():
         print("Could not open image at \"" + args.targetImage[0] + "\"")
         exit()
     sift = cv2.SIFT_create()
-    targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    if args.noCache:
+        targetPoints, targetDescriptions = sift.detectAndCompute(targetImage, None)
+    else:
+        targetPoints, targetDescriptions = siftcache.cachedDetectAndCompute(sift, targetImage)
 
     # Create the matching system and match features for each frame
     matcher = cv2.BFMatcher()
-    writtenImage = None
     capture = cv2.VideoCapture(args.inputVideo[0])
     if not capture.isOpened():
         print("Could not open the video at \"" + args.inputVideo[0] + "\"")
         exit()
-    while capture.isOpened():
-        startTime = time.time()
-        ret, videoImg = capture.read()
-        if not ret: break
+    def processFrame(videoImg):
+        nonlocal inlierCount, matchCount
         keypoints, descriptions = sift.detectAndCompute(videoImg, None)
         
         # Run the matching system
@@ -80,17 +83,13 @@ def main():
             distortion = cv2.perspectiveTransform(targetPerspectivePoints, targetObject)
             videoImg = cv2.polylines(videoImg, [np.int32(distortion)], True, color=(0,255,0), thickness=3, lineType=cv2.LINE_AA)
 
-        writtenImage = cv2.drawMatches(targetImage, targetPoints, videoImg, keypoints,
+        return cv2.drawMatches(targetImage, targetPoints, videoImg, keypoints,
             good, None, singlePointColor=None, matchColor=(255,0,255), matchesMask=matchesMask, 
             flags=2|cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
-        cv2.imshow(WINDOW_NAME, writtenImage)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-        if args.fps is not None: 
-            sleepTime = (1 / args.fps[0]) - (time.time() - startTime)
-            if sleepTime > 0: sleep(sleepTime)
-    capture.release()
 
-    cv2.imshow(WINDOW_NAME, writtenImage)
+    # Display
+    print(playback.play(playback.readVideo(capture), processFrame, WINDOW_NAME, fps=args.fps[0],
+        dropLate=True))
     cv2.waitKey(0)
     cv2.destroyWindow(WINDOW_NAME)
 
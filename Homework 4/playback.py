@@ -0,0 +1,19 @@
+"""
+Loads the playback scheduler shared by every homework from the root of the repository.
+"""
+import os
+import sys
+import importlib.util
+
+SHARED_MODULE = "sharedplayback"
+SHARED_FILE = os.path.dirname(os.path.dirname(os.path.realpath(__file__))) + os.path.sep + \
+    "playback.py"
+
+if SHARED_MODULE not in sys.modules:
+    spec = importlib.util.spec_from_file_location(SHARED_MODULE, SHARED_FILE)
+    sys.modules[SHARED_MODULE] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules[SHARED_MODULE])
+
+from sharedplayback import QUEUE_SIZE, PlaybackStats, readVideo, play
+
+__all__ = ["QUEUE_SIZE", "PlaybackStats", "readVideo", "play"]
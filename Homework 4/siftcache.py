@@ -0,0 +1,98 @@
+"""
+Keeps the SIFT keypoints and descriptors of target images on disk, keyed by the image
+content and the SIFT parameters, so later runs can load them instead of recomputing.
+"""
+
+import os
+import json
+import hashlib
+
+import cv2
+import numpy as np
+
+
+CACHE_DIR = os.path.dirname(os.path.realpath(__file__)) + os.path.sep + ".cache"
+
+def siftParams(sift):
+    """Gets the parameters that change what a SIFT detector finds.
+
+    Args:
+        sift (cv2.SIFT): The detector.
+
+    Returns:
+        dict: The parameters of the detector.
+    """
+    return {"nfeatures": sift.getNFeatures(), "nOctaveLayers": sift.getNOctaveLayers(),
+        "contrastThreshold": sift.getContrastThreshold(),
+        "edgeThreshold": sift.getEdgeThreshold(), "sigma": sift.getSigma()}
+
+
+def saveFeatures(path, keypoints, descriptors):
+    """Writes keypoints as columns of their fields, along with their descriptors.
+
+    Args:
+        path (str): The .npz file to write.
+        keypoints (list): The cv2.KeyPoint of each feature.
+        descriptors (np.ndarray): The descriptor of each feature, or None.
+    """
+    points = np.array([keypoint.pt for keypoint in keypoints], dtype=np.float32).reshape(-1, 2)
+    columns = dict(x=points[:, 0], y=points[:, 1],
+        size=np.array([keypoint.size for keypoint in keypoints], dtype=np.float32),
+        angle=np.array([keypoint.angle for keypoint in keypoints], dtype=np.float32),
+        response=np.array([keypoint.response for keypoint in keypoints], dtype=np.float32),
+        octave=np.array([keypoint.octave for keypoint in keypoints], dtype=np.int32),
+        classId=np.array([keypoint.class_id for keypoint in keypoints], dtype=np.int32))
+    if descriptors is None: descriptors = np.empty((0, 128), dtype=np.float32)
+
+    tempFile = path + ".%d.tmp" % os.getpid()
+    with open(tempFile, 'wb') as out:
+        np.savez(out, descriptors=descriptors, **columns)
+    os.replace(tempFile, path)
+
+
+def loadFeatures(path):
+    """Reads keypoints and descriptors written by saveFeatures.
+
+    Args:
+        path (str): The .npz file to read.
+
+    Returns:
+        keypoints, descriptors: The keypoints as a tuple of cv2.KeyPoint, and their
+            descriptors or None when there are none, as from sift.detectAndCompute.
+    """
+    with np.load(path) as data:
+        keypoints = tuple(cv2.KeyPoint(float(x), float(y), float(size), float(angle),
+            float(response), int(octave), int(classId)) for x, y, size, angle, response,
+            octave, classId in zip(data["x"], data["y"], data["size"], data["angle"],
+            data["response"], data["octave"], data["classId"]))
+        descriptors = data["descriptors"]
+
+    return keypoints, descriptors if len(keypoints) > 0 else None
+
+
+def cachedDetectAndCompute(sift, image, cacheDir=CACHE_DIR):
+    """Loads the keypoints and descriptors of an image from the cache, detecting and
+    storing them first if this image has not been seen with these parameters.
+
+    Args:
+        sift (cv2.SIFT): The detector to use.
+        image (cv2.Mat): The image to detect features in.
+        cacheDir (str, optional): The directory to keep cached features in. Defaults
+            to ".cache" beside this module.
+
+    Returns:
+        keypoints, descriptors: The features, as from sift.detectAndCompute.
+    """
+    digest = hashlib.sha1(json.dumps([image.shape, str(image.dtype), siftParams(sift)],
+        sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    cacheFile = cacheDir + os.path.sep + digest.hexdigest() + ".npz"
+    if os.path.isfile(cacheFile):
+        return loadFeatures(cacheFile)
+
+    keypoints, descriptors = sift.detectAndCompute(image, None)
+
+    os.makedirs(cacheDir, exist_ok=True)
+    saveFeatures(cacheFile, keypoints, descriptors)
+
+    return keypoints, descriptors
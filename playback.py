@@ -0,0 +1,141 @@
+"""
+Plays processed video at a target frame rate, processing frames on a background thread
+while the calling thread displays them against per-frame deadlines. Frames that miss
+their deadline are dropped instead of stalling playback, and optionally skipped before
+they are processed.
+"""
+import time
+import queue
+import threading
+
+import cv2
+
+QUEUE_SIZE = 4
+
+
+class PlaybackStats:
+    """Counts what happened during playback."""
+
+    def __init__(self):
+        self.processed = 0
+        self.displayed = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.elapsed = 0.
+        self.lastImage = None
+        self.quit = False
+
+    @property
+    def fps(self):
+        """float: The achieved display rate."""
+        return self.displayed / self.elapsed if self.elapsed > 0 else 0.
+
+    def __str__(self):
+        return "%.1f fps achieved, %d of %d frames dropped, %d of them unprocessed" % (
+            self.fps, self.dropped + self.skipped, self.processed + self.skipped,
+            self.skipped)
+
+
+def readVideo(capture):
+    """Reads every frame from an opened capture, releasing it when done.
+
+    Args:
+        capture (cv2.VideoCapture): The capture to read from.
+
+    Yields:
+        Each frame.
+    """
+    try:
+        while capture.isOpened():
+            ret, frame = capture.read()
+            if not ret: break
+            yield frame
+    finally:
+        capture.release()
+
+
+def play(frames, process, windowName, fps=None, quitKey='q', dropLate=False):
+    """Processes each frame on a background thread and shows the results in a window,
+    frame i being due i/fps seconds after playback starts.
+
+    A result that is already late when the next result is waiting is dropped. With
+    dropLate, a frame that is already late before it is processed is skipped as well, so
+    slow processing keeps up with the video instead of playing it in slow motion. Leave
+    it off when process has to see every frame. Without an fps, results are shown as
+    soon as they are ready and nothing is skipped.
+
+    Args:
+        frames (iterable): The frames to process.
+        process (callable): Turns a frame into the image to show, or None to show nothing.
+        windowName (str): The window to show the images in.
+        fps (float, optional): The target frame rate. Defaults to None.
+        quitKey (str, optional): The key that stops playback. Defaults to 'q'.
+        dropLate (bool, optional): Skip frames that are late before processing them.
+            Defaults to False.
+
+    Returns:
+        PlaybackStats: The frame counts, achieved frame rate, and last shown image.
+    """
+    stats = PlaybackStats()
+    results = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for index, frame in enumerate(frames):
+                if stop.is_set(): break
+                if dropLate and fps is not None and \
+                    time.perf_counter() > start + (index + 1) / fps:
+                    stats.skipped += 1
+                    continue
+                image = process(frame)
+                stats.processed += 1
+                while not stop.is_set():
+                    try:
+                        results.put((index, image), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            while True:
+                try:
+                    results.put(done, timeout=0.1)
+                    break
+                except queue.Full:
+                    if stop.is_set(): break
+
+    worker = threading.Thread(target=produce, daemon=True)
+    start = time.perf_counter()
+    worker.start()
+    try:
+        while True:
+            result = results.get()
+            if result is done: break
+            index, image = result
+            if image is None: continue
+
+            if fps is not None:
+                deadline = start + index / fps
+                now = time.perf_counter()
+                if now > deadline + 1 / fps and not results.empty():
+                    stats.dropped += 1
+                    continue
+                if now < deadline: time.sleep(deadline - now)
+
+            cv2.imshow(windowName, image)
+            stats.lastImage = image
+            stats.displayed += 1
+            if cv2.waitKey(1) & 0xFF == ord(quitKey):
+                stats.quit = True
+                break
+    finally:
+        stop.set()
+        worker.join()
+        stats.elapsed = time.perf_counter() - start
+
+    if errors: raise errors[0]
+    return stats